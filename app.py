@@ -1,104 +1,180 @@
+from gevent import monkey
+monkey.patch_all()
+
+import grpc.experimental.gevent as grpc_gevent
+grpc_gevent.init_gevent()
+
 import os
-import json
-import base64
 import logging
+import time
 from flask import Flask, request
 from flask_talisman import Talisman
 from twilio.twiml.voice_response import VoiceResponse, Connect
 from google.cloud import speech
-from elevenlabs.client import ElevenLabs
-from pydub import AudioSegment
-from io import BytesIO
 import tempfile # ייבוא חדש עבור קבצים זמניים
 
+import gevent
 from gevent import pywsgi
 from geventwebsocket.handler import WebSocketHandler
 
+from audio_codec import make_transcoder
+import bot
+from bot import get_bot_response, is_static_response
+from call_session import CallSession
+from media_scheduler import OutboundScheduler
+from recording import RecordingArchive
+from telemetry import TRANSCODE_SECONDS, CallTrace, TraceWriter, make_metrics_app
+from tts_cache import TTSCache, iter_frames
+from vad import VADConfig
+from warm_path import WarmPathManager
+
 # --- Logging ---
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per TTS request otherwise
 logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 GCP_CREDENTIALS_JSON = os.environ.get("GCP_CREDENTIALS_JSON")
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID")
+ELEVENLABS_API_BASE = os.environ.get("ELEVENLABS_API_BASE", "https://api.elevenlabs.io")
+# host:port of a plaintext Speech server, e.g. benchmarks/fake_speech_server.py; skips GCP credentials
+SPEECH_EMULATOR_HOST = os.environ.get("SPEECH_EMULATOR_HOST")
 
 SAMPLE_RATE = 8000
 LANGUAGE_CODE = "he-IL"
+AUDIO_CODEC = os.environ.get("AUDIO_CODEC", "native")  # "native" (NumPy) or "pydub" (ffmpeg per chunk)
+
+ELEVENLABS_MODEL = "eleven_multilingual_v2"
+ELEVENLABS_OUTPUT_FORMAT = "pcm_16000"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts_cache"))
+TTS_CACHE_MAX_ENTRIES = int(os.environ.get("TTS_CACHE_MAX_ENTRIES", 256))
+
+OUTBOUND_LEAD_MS = int(os.environ.get("OUTBOUND_LEAD_MS", 60))  # how far ahead of playout we send frames
+OUTBOUND_MAX_QUEUED_FRAMES = int(os.environ.get("OUTBOUND_MAX_QUEUED_FRAMES", 250))  # 5 s of audio per call
+
+STT_STREAM_LIMIT_SECONDS = int(os.environ.get("STT_STREAM_LIMIT_SECONDS", 290))  # Google caps a stream at ~305 s
+STT_STREAM_OVERLAP_MS = int(os.environ.get("STT_STREAM_OVERLAP_MS", 300))  # audio replayed into the next stream
+INGEST_COALESCE_MS = int(os.environ.get("INGEST_COALESCE_MS", 100))  # inbound audio per recognition request
+INGEST_BUFFER_SECONDS = int(os.environ.get("INGEST_BUFFER_SECONDS", 10))  # per-call ring buffer before drops
+
+# Local VAD gating of audio sent to Google; tune with VAD_MARGIN_DB, VAD_HANGOVER_MS, ... (see vad.VADConfig)
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "1") == "1"
+VAD_CONFIG = VADConfig.from_env() if VAD_ENABLED else None
+
+# Per-call tracing: stage timings feed /metrics; TRACE_LOG_PATH also dumps one JSON line per call
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))  # share of calls whose per-turn DEBUG logs are kept
+trace_writer = TraceWriter(TRACE_LOG_PATH) if TRACE_LOG_PATH else None
+# Prometheus /metrics gets its own listener, off the public webhook port; METRICS_PORT=0 disables it.
+# Loopback by default; set METRICS_HOST=0.0.0.0 to expose it on a private network, METRICS_TOKEN to require a bearer token.
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8081))  # next to PORT; 9100 is node_exporter's
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+SPEECH_CHANNELS = int(os.environ.get("SPEECH_CHANNELS", 4))  # pooled keepalive gRPC channels to Speech
+TTS_MAX_CONNECTIONS = int(os.environ.get("TTS_MAX_CONNECTIONS", 64))  # idle keepalive connections to ElevenLabs
+WARM_PATH_TTL_SECONDS = int(os.environ.get("WARM_PATH_TTL_SECONDS", 30))  # how long /voice warm-up waits for /stream
+
+# Stereo WAV + JSONL archive of every call (caller left, bot right); unset RECORDING_DIR disables it
+RECORDING_DIR = os.environ.get("RECORDING_DIR")
+RECORDING_BUFFER_SECONDS = int(os.environ.get("RECORDING_BUFFER_SECONDS", 30))  # per call: how far the disk may lag before recordings drop
+RECORDING_FSYNC_SECONDS = float(os.environ.get("RECORDING_FSYNC_SECONDS", 5))
+recording_archive = RecordingArchive(
+    RECORDING_DIR, buffer_seconds=RECORDING_BUFFER_SECONDS, fsync_seconds=RECORDING_FSYNC_SECONDS
+) if RECORDING_DIR else None
 
 # --- App ---
 app = Flask(__name__)
 Talisman(app, content_security_policy=None)
 
-# --- Google Credentials ---
-def load_gcp_credentials():
-    global _gcp_creds_file_path # משתנה גלובלי לשמירת הנתיב לקובץ הזמני
-    _gcp_creds_file_path = None # אתחול
+# --- Clients ---
+def make_streaming_config():
+    return speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.MULAW,
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code=LANGUAGE_CODE,
+        ),
+        interim_results=True,  # without VAD, interim results while the bot is speaking trigger barge-in
+        single_utterance=True,
+    )
 
-    try:
-        if not GCP_CREDENTIALS_JSON:
-            logger.critical("GCP_CREDENTIALS_JSON environment variable is not set. Cannot proceed with GCP authentication.")
-            return False
-
-        # יצירת קובץ זמני עם tempfile כדי לנהל אותו באופן בטוח יותר
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_creds_file:
-            temp_creds_file.write(GCP_CREDENTIALS_JSON)
-            _gcp_creds_file_path = temp_creds_file.name
-        
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = _gcp_creds_file_path
-        logger.info(f"GCP credentials written to temporary file: {_gcp_creds_file_path} and GOOGLE_APPLICATION_CREDENTIALS set.")
-        logger.info(f"Verifying temporary file existence: {os.path.exists(_gcp_creds_file_path)}")
-        return True
-    except json.JSONDecodeError as e:
-        logger.critical(f"Error decoding GCP_CREDENTIALS_JSON: {e}. Check its content for valid JSON.", exc_info=True)
-        return False
-    except Exception as e:
-        logger.critical(f"Critical error during GCP credentials loading: {e}", exc_info=True)
-        return False
+# Built lazily on first use (or by warm_up() once the server is listening), never at import time
+warm_path = WarmPathManager(
+    make_streaming_config,
+    gcp_credentials_json=GCP_CREDENTIALS_JSON,
+    speech_emulator_host=SPEECH_EMULATOR_HOST,
+    elevenlabs_api_key=ELEVENLABS_API_KEY,
+    elevenlabs_api_base=ELEVENLABS_API_BASE,
+    speech_channels=SPEECH_CHANNELS,
+    tts_connections=TTS_MAX_CONNECTIONS,
+    prepared_ttl=WARM_PATH_TTL_SECONDS,
+)
 
+# --- TTS ---
+tts_cache = TTSCache(TTS_CACHE_DIR, max_entries=TTS_CACHE_MAX_ENTRIES, codec=AUDIO_CODEC)
 
-# --- Clients ---
-def init_clients():
-    global speech_client, elevenlabs_client
-    logger.info("Initializing Google Cloud Speech and ElevenLabs clients...")
-    
-    if not load_gcp_credentials():
-        logger.critical("Failed to load GCP credentials. Speech-to-Text will not work.")
-        speech_client = None # Set to None to indicate failure
-    else:
-        try:
-            speech_client = speech.SpeechClient()
-            logger.info("Google Cloud Speech client initialized successfully.")
-        except Exception as e:
-            logger.critical(f"Failed to initialize Google Cloud Speech client AFTER loading credentials: {e}", exc_info=True)
-            speech_client = None
+def tts_available(text):
+    return warm_path.tts_client() is not None or tts_cache.contains(
+        text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT
+    )
 
-    if not ELEVENLABS_API_KEY:
-        logger.critical("ELEVENLABS_API_KEY environment variable is not set. Text-to-Speech will not work.")
-        elevenlabs_client = None # Set to None to indicate failure
-    else:
-        elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        logger.info("ElevenLabs client initialized.")
+def synthesize_mulaw(text):
+    """Yield 8 kHz mu-law audio for text, from the TTS cache when possible.
 
-init_clients()
+    On a miss the ElevenLabs stream is transcoded and yielded as it arrives,
+    and the complete rendering is stored in the cache once the stream ends.
+    """
+    cached = tts_cache.get(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT)
+    if cached is not None:
+        logger.debug(f"TTS cache hit ({tts_cache.stats['hits']} hits / {tts_cache.stats['misses']} misses).")
+        yield from iter_frames(cached)
+        return
 
-# --- Cleanup function for temporary GCP credentials file ---
-def cleanup_gcp_creds_file():
-    if '_gcp_creds_file_path' in globals() and _gcp_creds_file_path and os.path.exists(_gcp_creds_file_path):
+    logger.debug(f"TTS cache miss, generating TTS for: '{text}'")
+    audio_stream = warm_path.tts_client().generate(
+        text=text,
+        voice=ELEVENLABS_VOICE_ID,
+        model=ELEVENLABS_MODEL,
+        stream=True,
+        output_format=ELEVENLABS_OUTPUT_FORMAT
+    )
+    logger.debug("ElevenLabs audio stream started.")
+
+    transcoder = make_transcoder(AUDIO_CODEC)
+    rendered = bytearray()
+    for chunk in audio_stream:
+        if chunk:
+            t0 = time.perf_counter()
+            mulaw = transcoder.feed(chunk)
+            TRANSCODE_SECONDS.inc(time.perf_counter() - t0)
+            if mulaw:
+                rendered += mulaw
+                yield mulaw
+    tail = transcoder.flush()
+    if tail:
+        rendered += tail
+        yield tail
+    if is_static_response(text):  # replies with slot values are one-offs; they would only evict the prompts
+        tts_cache.put(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT, rendered)
+
+def prewarm_tts_cache():
+    if warm_path.tts_client() is None:
+        logger.warning("ElevenLabs client is not initialized. Skipping TTS cache pre-warm.")
+        return
+    if not tts_cache.enabled:
+        logger.info("TTS cache is disabled. Skipping TTS cache pre-warm.")
+        return
+    for text in bot.BOT_RESPONSES:
+        if tts_cache.contains(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT):
+            continue
         try:
-            os.remove(_gcp_creds_file_path)
-            logger.info(f"Temporary GCP credentials file '{_gcp_creds_file_path}' removed.")
+            for _ in synthesize_mulaw(text):
+                pass
         except Exception as e:
-            logger.warning(f"Could not remove temporary GCP credentials file '{_gcp_creds_file_path}': {e}")
-
-# --- Bot Logic ---
-def get_bot_response(text):
-    logger.info(f"User: {text}")
-    if "שלום" in text or "היי" in text:
-        return "שלום גם לך! אני בוט קולי. מה שלומך?"
-    elif "שם" in text:
-        return "שמי בוט, ואני שמח לדבר איתך."
-    return "לא הבנתי את מה שאמרת. אפשר לחזור על זה?"
+            logger.error(f"Failed to pre-render TTS for '{text}': {e}", exc_info=True)
+    logger.info(f"TTS cache pre-warm finished: {tts_cache.stats}")
 
 # --- Voice Webhook ---
 @app.route("/voice", methods=["POST"])
@@ -108,132 +184,67 @@ def voice():
     stream_url = os.environ.get("WEBSOCKET_STREAM_URL", "wss://web-production-770fa.up.railway.app/stream")
     connect.stream(url=stream_url)
     response.append(connect)
-    logger.info(f"Generated TwiML for call with stream URL: {stream_url}")
+    logger.debug(f"Generated TwiML for call with stream URL: {stream_url}")
+    # Twilio connects the media stream next; use the gap to open this call's connections.
+    warm_path.prepare(request.form.get("CallSid"))
     return str(response), 200, {"Content-Type": "application/xml"}
 
 # --- WebSocket Route ---
-@app.route("/stream")
+@app.route("/stream", websocket=True)  # Werkzeug rejects upgrade requests on non-websocket rules
 def stream():
-    logger.info("🔌 /stream endpoint was called.")
-
     if request.environ.get("wsgi.websocket"):
-        logger.info("✅ WebSocket upgrade successful. Attempting to connect.")
         ws = request.environ["wsgi.websocket"]
-        logger.info("WebSocket connected.")
-
         stream_sid = request.environ.get("HTTP_X_TWILIO_STREAM_SID", "unknown_sid")
-        logger.info(f"Stream SID: {stream_sid}")
 
+        speech_client = warm_path.speech_client()
         if speech_client is None:
             logger.error("Speech client is not initialized. Cannot perform speech recognition.")
             ws.close()
             return "Speech client not ready", 500
 
-        recognition_config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.MULAW,
-            sample_rate_hertz=SAMPLE_RATE,
-            language_code=LANGUAGE_CODE,
-        )
-        streaming_config = speech.StreamingRecognitionConfig(
-            config=recognition_config,
-            interim_results=False,
-            single_utterance=True,
+        trace = CallTrace(LOG_SAMPLE_RATE, trace_writer)
+        if trace.log_sampled:
+            logger.debug(f"🔌 WebSocket connected on /stream. Stream SID: {stream_sid}")
+
+        recorder = recording_archive.open_call() if recording_archive is not None else None
+        scheduler = OutboundScheduler(
+            ws,
+            stream_sid,
+            lead_ms=OUTBOUND_LEAD_MS,
+            max_queued_frames=OUTBOUND_MAX_QUEUED_FRAMES,
+            tap=recorder.outbound if recorder is not None else None
+        ).start()
+
+        session = CallSession(
+            ws,
+            scheduler,
+            speech_client,
+            make_streaming_config(),
+            get_bot_response=get_bot_response,
+            synthesize=synthesize_mulaw,
+            tts_available=tts_available,
+            stream_limit_seconds=STT_STREAM_LIMIT_SECONDS,
+            overlap_ms=STT_STREAM_OVERLAP_MS,
+            coalesce_ms=INGEST_COALESCE_MS,
+            buffer_seconds=INGEST_BUFFER_SECONDS,
+            vad_config=VAD_CONFIG,
+            trace=trace,
+            claim_prepared=warm_path.claim,
+            recorder=recorder
         )
-        logger.info("Google Speech Recognition config set.")
-
-        def request_generator():
-            logger.info("Starting WebSocket request generator...")
-            while not ws.closed:
-                try:
-                    message = ws.receive()
-                    if message is None:
-                        logger.warning("Received None message from WebSocket (client disconnected?). Breaking generator.")
-                        break
-                    data = json.loads(message)
-                    if data.get("event") == "media":
-                        audio = base64.b64decode(data["media"]["payload"])
-                        yield speech.StreamingRecognizeRequest(audio_content=audio)
-                    elif data.get("event") == "start":
-                        logger.info(f"Twilio 'start' event received: {data}")
-                    elif data.get("event") == "stop":
-                        logger.info(f"Twilio 'stop' event received: {data}")
-                        break # Stop generator when Twilio signals stop
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON Decode Error in WebSocket message: {e}", exc_info=True)
-                    break
-                except Exception as e:
-                    logger.error(f"Unexpected error in WebSocket request generator: {e}", exc_info=True)
-                    break
-            logger.info("WebSocket request generator finished.")
 
         try:
-            logger.info("Calling speech_client.streaming_recognize...")
-            responses = speech_client.streaming_recognize(streaming_config, request_generator())
-            logger.info("Speech client streaming recognize started.")
-
-            for response in responses:
-                logger.info(f"Received speech recognition response: {response}")
-                if not response.results or not response.results[0].alternatives:
-                    logger.debug("No speech results or alternatives found in response.")
-                    continue
-
-                result = response.results[0]
-                if result.is_final:
-                    transcript = result.alternatives[0].transcript
-                    logger.info(f"Final transcript received: '{transcript}'")
-                    bot_response = get_bot_response(transcript)
-
-                    if elevenlabs_client is None:
-                        logger.error("ElevenLabs client is not initialized. Cannot perform Text-to-Speech.")
-                        break
-
-                    logger.info(f"Generating TTS for: '{bot_response}'")
-                    audio_stream = elevenlabs_client.generate(
-                        text=bot_response,
-                        voice=ELEVENLABS_VOICE_ID,
-                        model="eleven_multilingual_v2",
-                        stream=True,
-                        output_format="pcm_16000"
-                    )
-                    logger.info("ElevenLabs audio stream started.")
-
-                    # Notify Twilio that bot response is starting
-                    ws.send(json.dumps({
-                        "event": "mark",
-                        "streamSid": stream_sid,
-                        "mark": {"name": "bot_response_start"}
-                    }))
-                    logger.info("Sent 'mark' event to Twilio.")
-
-                    for chunk in audio_stream:
-                        if chunk:
-                            try:
-                                audio = AudioSegment(
-                                    data=chunk,
-                                    sample_width=2,
-                                    frame_rate=16000,
-                                    channels=1
-                                ).set_frame_rate(SAMPLE_RATE)
-                                mulaw = audio.export(format="mulaw").read()
-                                encoded = base64.b64encode(mulaw).decode("utf-8")
-                                ws.send(json.dumps({
-                                    "event": "media",
-                                    "streamSid": stream_sid,
-                                    "media": {"payload": encoded}
-                                }))
-                            except Exception as e:
-                                logger.error(f"Error processing or sending audio chunk: {e}", exc_info=True)
-                                break
-                    logger.info("Finished sending bot audio chunks.")
-                    break # Assuming single utterance interaction
-
+            session.run()
         except Exception as e:
             logger.error(f"Critical WebSocket handler error: {e}", exc_info=True) # Stack trace here
         finally:
-            logger.info("WebSocket connection closing...")
+            session.close()
+            scheduler.stop()
             if not ws.closed:
                 ws.close()
-            logger.info("WebSocket closed.")
+            if trace.log_sampled:
+                logger.debug("WebSocket closed.")
+        return ""  # Flask needs a response even though the socket already carried the call
 
     else:
         logger.warning("❌ Non-WebSocket request to /stream endpoint. This endpoint expects a WebSocket upgrade.")
@@ -248,9 +259,22 @@ if __name__ == "__main__":
         handler_class=WebSocketHandler
     )
     logger.info(f"WSGIServer listening on 0.0.0.0:{os.environ.get('PORT', 8080)}")
+    if METRICS_PORT:
+        metrics_server = pywsgi.WSGIServer((METRICS_HOST, METRICS_PORT), make_metrics_app(METRICS_TOKEN), log=None)
+        try:
+            metrics_server.start()
+            logger.info(f"Metrics served on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            # Calls matter more than metrics: keep serving /voice and /stream without them.
+            logger.error(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT}, running without /metrics: {e}")
+    gevent.spawn(warm_path.warm_up)
+    gevent.spawn(prewarm_tts_cache)
+    bot.on_responses_changed(lambda: gevent.spawn(prewarm_tts_cache))  # render prompts added by an intents reload
     try:
         server.serve_forever()
     except Exception as e:
         logger.critical(f"Failed to start WSGIServer: {e}", exc_info=True)
     finally:
-        cleanup_gcp_creds_file() # Ensure temporary file is cleaned up on exit
\ No newline at end of file
+        warm_path.close()
+        if recording_archive is not None:
+            recording_archive.close()
\ No newline at end of file
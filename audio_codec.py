@@ -0,0 +1,182 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Formats ---
+INPUT_RATE = 16000   # ElevenLabs "pcm_16000": signed 16-bit little-endian mono
+OUTPUT_RATE = 8000   # Twilio Media Streams: 8 kHz G.711 mu-law mono
+FRAME_BYTES = 160    # 20 ms of 8 kHz mu-law
+MULAW_SILENCE = 0xFF
+
+# --- G.711 mu-law tables ---
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 32635
+
+
+_ULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+
+
+def _build_ulaw_encode_table():
+    # One entry per possible int16 sample, indexed by its uint16 bit pattern.
+    # Same 14-bit reference algorithm as ffmpeg's pcm_mulaw encoder, so the
+    # output is bit-exact with what the old pydub path produced.
+    samples = np.arange(-32768, 32768, dtype=np.int32)
+    pcm = samples >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), _ULAW_CLIP >> 2) + (_ULAW_BIAS >> 2)
+    segment = np.searchsorted(_ULAW_SEGMENT_ENDS, pcm)
+    encoded = (segment << 4) | ((pcm >> (segment + 1)) & 0x0F)
+
+    table = np.empty(65536, dtype=np.uint8)
+    table[samples & 0xFFFF] = (encoded ^ mask) & 0xFF
+    return table
+
+
+def _build_ulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + _ULAW_BIAS) << exponent) - _ULAW_BIAS
+    return np.where(sign, -magnitude, magnitude).astype(np.int16)
+
+
+ULAW_ENCODE_TABLE = _build_ulaw_encode_table()
+ULAW_DECODE_TABLE = _build_ulaw_decode_table()
+
+
+def mulaw_encode(samples):
+    """Encode an int16 ndarray to mu-law bytes with a single table lookup."""
+    return ULAW_ENCODE_TABLE[samples.view(np.uint16)].tobytes()
+
+
+def mulaw_decode(data):
+    """Decode mu-law bytes (or a uint8 ndarray) to an int16 ndarray."""
+    return ULAW_DECODE_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+# --- 2:1 polyphase decimator ---
+def _design_lowpass(num_taps=32, cutoff_hz=3600.0, rate=INPUT_RATE):
+    # Hamming-windowed sinc, normalized to unity gain at DC.
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    taps = np.sinc(2.0 * cutoff_hz / rate * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class Resampler16kTo8k:
+    """Stateful 16 kHz -> 8 kHz decimator.
+
+    The anti-aliasing FIR is split into its even and odd phases so every
+    output sample costs ``num_taps`` multiplies instead of ``2 * num_taps``.
+    The last ``num_taps`` input samples are carried between calls, so a
+    stream resampled chunk by chunk is identical to the same stream
+    resampled in one go (no clicks at chunk edges).
+    """
+
+    def __init__(self, num_taps=32):
+        if num_taps % 2:
+            raise ValueError("num_taps must be even")
+        taps = _design_lowpass(num_taps)
+        self._half = num_taps // 2
+        self._even_taps = taps[0::2]
+        self._odd_taps = taps[1::2]
+        self._history = np.zeros(num_taps, dtype=np.float32)
+        self._pending = None  # one leftover input sample when a chunk has odd length
+
+    def process(self, samples):
+        """Resample an int16 ndarray; returns an int16 ndarray of half the length."""
+        if self._pending is not None:
+            samples = np.concatenate((self._pending, samples))
+            self._pending = None
+        if len(samples) % 2:
+            self._pending = samples[-1:].copy()
+            samples = samples[:-1]
+        if not len(samples):
+            return np.empty(0, dtype=np.int16)
+
+        buf = np.concatenate((self._history, samples.astype(np.float32)))
+        self._history = buf[-len(self._history):]
+
+        out = np.convolve(buf[1::2], self._even_taps, mode="valid")[1:]
+        out += np.convolve(buf[0::2], self._odd_taps, mode="valid")[1:]
+        np.rint(out, out=out)
+        np.clip(out, -32768, 32767, out=out)
+        return out.astype(np.int16)
+
+    def reset(self):
+        self._history[:] = 0
+        self._pending = None
+
+
+# --- Transcoders ---
+class PcmToMulawTranscoder:
+    """Streaming pcm_16000 -> 8 kHz mu-law transcoder (NumPy, in-process).
+
+    ``feed()`` accepts raw little-endian PCM16 bytes of any length, including
+    chunks that split a sample in half, and returns whatever mu-law bytes are
+    ready. Call ``flush()`` once the source is exhausted.
+    """
+
+    name = "native"
+
+    def __init__(self):
+        self._resampler = Resampler16kTo8k()
+        self._odd_byte = b""
+
+    def feed(self, chunk):
+        if self._odd_byte:
+            chunk = self._odd_byte + chunk
+            self._odd_byte = b""
+        usable = len(chunk) & ~1
+        if usable != len(chunk):
+            self._odd_byte = chunk[usable:]
+        if not usable:
+            return b""
+        samples = np.frombuffer(chunk, dtype="<i2", count=usable // 2)
+        return mulaw_encode(self._resampler.process(samples))
+
+    def flush(self):
+        # Drop a dangling half sample and push one silent sample through so
+        # a sample held back for pairing is not lost.
+        self._odd_byte = b""
+        if self._resampler._pending is None:
+            return b""
+        return mulaw_encode(self._resampler.process(np.zeros(1, dtype=np.int16)))
+
+
+class PydubTranscoder:
+    """Legacy per-chunk path: one ffmpeg export per chunk via pydub."""
+
+    name = "pydub"
+
+    def __init__(self):
+        from pydub import AudioSegment
+        self._segment_cls = AudioSegment
+
+    def feed(self, chunk):
+        audio = self._segment_cls(
+            data=chunk,
+            sample_width=2,
+            frame_rate=INPUT_RATE,
+            channels=1
+        ).set_frame_rate(OUTPUT_RATE)
+        return audio.export(format="mulaw").read()
+
+    def flush(self):
+        return b""
+
+
+TRANSCODERS = {
+    PcmToMulawTranscoder.name: PcmToMulawTranscoder,
+    PydubTranscoder.name: PydubTranscoder,
+}
+
+
+def make_transcoder(codec="native"):
+    try:
+        return TRANSCODERS[codec]()
+    except KeyError:
+        logger.warning(f"Unknown audio codec '{codec}', falling back to 'native'.")
+        return PcmToMulawTranscoder()
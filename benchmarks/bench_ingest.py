@@ -0,0 +1,95 @@
+"""Benchmark: inbound Twilio media ingestion, per-frame path vs. batched path.
+
+"before" is the original request_generator(): json.loads + base64 decode and
+one StreamingRecognizeRequest per 20 ms frame. "after" is the ingest.py path:
+fast event parsing, decode into the per-call ring buffer and one request per
+--coalesce-ms of audio. Both are measured in CPU time on a single core.
+
+Usage:
+    python benchmarks/bench_ingest.py [--frames 50000] [--coalesce-ms 100]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import speech  # noqa: E402
+
+from ingest import BYTES_PER_SECOND, AudioRingBuffer, decode_payload, parse_twilio_event  # noqa: E402
+
+FRAME_BYTES = 160
+
+
+def make_messages(count):
+    payload = base64.b64encode(os.urandom(FRAME_BYTES)).decode("ascii")
+    return [
+        json.dumps({
+            "event": "media",
+            "sequenceNumber": str(i + 2),
+            "media": {"track": "inbound", "chunk": str(i + 1), "timestamp": str(i * 20), "payload": payload},
+            "streamSid": "MZ00000000000000000000000000000000",
+        }, separators=(",", ":"))
+        for i in range(count)
+    ]
+
+
+def run_before(messages):
+    requests = 0
+    for message in messages:
+        data = json.loads(message)
+        if data.get("event") == "media":
+            audio = base64.b64decode(data["media"]["payload"])
+            speech.StreamingRecognizeRequest(audio_content=audio)
+            requests += 1
+    return requests
+
+
+def run_after(messages, coalesce_ms):
+    ring = AudioRingBuffer(10 * BYTES_PER_SECOND)
+    coalesce_bytes = coalesce_ms * BYTES_PER_SECOND // 1000
+    pos = 0
+    requests = 0
+    for message in messages:
+        event, payload = parse_twilio_event(message)
+        if event == "media":
+            ring.write(decode_payload(payload))
+            if ring.end - pos >= coalesce_bytes:
+                audio, pos = ring.read(pos, timeout=0, min_bytes=coalesce_bytes)
+                speech.StreamingRecognizeRequest(audio_content=audio)
+                requests += 1
+    return requests
+
+
+def measure(fn, *args):
+    start = time.process_time()
+    requests = fn(*args)
+    return time.process_time() - start, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=50000, help="number of 20 ms media messages")
+    parser.add_argument("--coalesce-ms", type=int, default=100, help="audio per recognition request on the new path")
+    args = parser.parse_args()
+
+    messages = make_messages(args.frames)
+    results = {
+        "before": measure(run_before, messages),
+        "after": measure(run_after, messages, args.coalesce_ms),
+    }
+    for name, (cpu, requests) in results.items():
+        fps = args.frames / cpu
+        print(
+            f"{name:>6}: {fps:12,.0f} frames/s per core | "
+            f"{requests:6d} recognition requests | "
+            f"~{fps / 50:8,.0f} concurrent calls per core (ingestion only)"
+        )
+    print(f"speedup: x{results['before'][0] / results['after'][0]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
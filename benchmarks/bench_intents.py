@@ -0,0 +1,94 @@
+"""Micro-benchmark: compiled intent index vs. a linear substring scan, at growing intent counts.
+
+Synthetic Hebrew-like intents (2-4 phrases of 1-3 words each) are matched
+against 12-word transcripts, half of which contain a known phrase. The
+compiled index should cost about the same per transcript at 10 or 10,000
+intents. The linear scan grows with the number of phrases.
+
+Usage:
+    python benchmarks/bench_intents.py [--sizes 10,100,1000,10000] [--transcripts 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import SCHEMA_VERSION, IntentIndex, normalize_hebrew  # noqa: E402
+
+LETTERS = "אבגדהוזחטיכלמנסעפצקרשת"
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 6))))
+    return sorted(words)
+
+
+def make_data(rng, vocabulary, intents):
+    specs = []
+    for i in range(intents):
+        phrases = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 3))) for _ in range(rng.randint(2, 4))]
+        specs.append({"name": f"intent_{i}", "priority": rng.randint(0, 3), "response": f"תשובה {i}", "phrases": phrases})
+    return {"schema": SCHEMA_VERSION, "version": "bench", "fallback": "לא הבנתי", "fuzzy": {"enabled": True}, "intents": specs}
+
+
+def make_transcripts(rng, vocabulary, data, count):
+    transcripts = []
+    for n in range(count):
+        words = [rng.choice(vocabulary) for _ in range(12)]
+        if n % 2 == 0:
+            spec = rng.choice(data["intents"])
+            words[rng.randint(0, 8)] = "ו" + rng.choice(spec["phrases"])  # with a clitic prefix
+        transcripts.append(" ".join(words))
+    return transcripts
+
+
+def linear_scan(data, text):
+    """The substring checks get_bot_response() used to do, generalized to many intents."""
+    text = normalize_hebrew(text)
+    for spec in data["intents"]:
+        for phrase in spec["phrases"]:
+            if phrase in text:
+                return spec["response"]
+    return data["fallback"]
+
+
+def per_call_us(fn, transcripts):
+    start = time.perf_counter()
+    for text in transcripts:
+        fn(text)
+    return (time.perf_counter() - start) / len(transcripts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="comma separated intent counts")
+    parser.add_argument("--transcripts", type=int, default=2000, help="transcripts matched per size")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="distinct synthetic words")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    for size in (int(s) for s in args.sizes.split(",")):
+        data = make_data(rng, vocabulary, size)
+        transcripts = make_transcripts(rng, vocabulary, data, args.transcripts)
+        t0 = time.perf_counter()
+        index = IntentIndex(data)
+        compile_ms = (time.perf_counter() - t0) * 1000
+        matched = sum(index.match(text) is not None for text in transcripts)
+        compiled_us = per_call_us(index.match, transcripts)
+        linear_us = per_call_us(lambda text: linear_scan(data, text), transcripts[: max(50, args.transcripts // 10)])
+        print(
+            f"{size:>6} intents ({len(index.patterns):>6} phrases): compile {compile_ms:8.1f} ms | "
+            f"compiled {compiled_us:8.1f} us/match | linear {linear_us:9.1f} us/match | "
+            f"matched {matched}/{len(transcripts)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
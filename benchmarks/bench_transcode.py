@@ -0,0 +1,67 @@
+"""Micro-benchmark: pcm_16000 -> 8 kHz mu-law, native NumPy path vs. pydub/ffmpeg.
+
+Usage:
+    python benchmarks/bench_transcode.py [--seconds 10] [--chunk-bytes 4096]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_codec import INPUT_RATE, make_transcoder  # noqa: E402
+
+
+def make_pcm(seconds):
+    # Voice-band noise with a slow amplitude envelope, roughly speech-like.
+    rng = np.random.default_rng(0)
+    n = int(seconds * INPUT_RATE)
+    envelope = 0.5 + 0.5 * np.sin(np.linspace(0, 6 * np.pi * seconds, n))
+    samples = rng.standard_normal(n) * 4000 * envelope
+    return np.clip(samples, -32768, 32767).astype("<i2").tobytes()
+
+
+def run(codec, pcm, chunk_bytes):
+    transcoder = make_transcoder(codec)
+    chunk_times = []
+    out_bytes = 0
+    start = time.perf_counter()
+    for offset in range(0, len(pcm), chunk_bytes):
+        t0 = time.perf_counter()
+        out_bytes += len(transcoder.feed(pcm[offset:offset + chunk_bytes]))
+        chunk_times.append(time.perf_counter() - t0)
+    out_bytes += len(transcoder.flush())
+    total = time.perf_counter() - start
+    return total, chunk_times, out_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10.0, help="audio duration to transcode")
+    parser.add_argument("--chunk-bytes", type=int, default=4096, help="size of each PCM chunk fed in")
+    parser.add_argument("--codecs", default="native,pydub", help="comma separated codec names")
+    args = parser.parse_args()
+
+    pcm = make_pcm(args.seconds)
+    print(f"{args.seconds:.1f}s of audio, {len(pcm)} bytes, {args.chunk_bytes}-byte chunks")
+    for codec in args.codecs.split(","):
+        try:
+            total, chunk_times, out_bytes = run(codec, pcm, args.chunk_bytes)
+        except Exception as e:
+            print(f"{codec:>8}: failed ({e})")
+            continue
+        chunk_ms = np.array(chunk_times) * 1000
+        print(
+            f"{codec:>8}: total {total * 1000:8.2f} ms | "
+            f"realtime x{args.seconds / total:9.1f} | "
+            f"per chunk p50 {np.percentile(chunk_ms, 50):7.3f} ms, "
+            f"p99 {np.percentile(chunk_ms, 99):7.3f} ms | "
+            f"{out_bytes} bytes out"
+        )
+
+
+if __name__ == "__main__":
+    main()
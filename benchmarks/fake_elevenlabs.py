@@ -0,0 +1,75 @@
+"""Local stand-in for the ElevenLabs streaming text-to-speech endpoint.
+
+Serves POST /v1/text-to-speech/{voice_id}/stream. The response is 16 kHz
+PCM16: a tone whose length grows with the text length. The first chunk
+arrives after ``--first-byte-ms``, and later chunks are paced at
+``--realtime`` times playback speed, roughly like the real service.
+
+Usage:
+    python benchmarks/fake_elevenlabs.py [--port 8090] [--first-byte-ms 250] [--ms-per-char 60]
+
+Point the server under test at it with ELEVENLABS_API_BASE=http://127.0.0.1:8090.
+"""
+import argparse
+import asyncio
+
+import numpy as np
+from aiohttp import web
+
+SAMPLE_RATE = 16000
+CHUNK_MS = 100
+
+
+def render_tone(duration_ms, freq=440.0):
+    t = np.arange(int(SAMPLE_RATE * duration_ms / 1000)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * freq * t) * 8000).astype("<i2").tobytes()
+
+
+class FakeElevenLabs:
+    def __init__(self, first_byte_ms=250, ms_per_char=60, min_ms=400, realtime=4.0):
+        self.first_byte = first_byte_ms / 1000.0
+        self.ms_per_char = ms_per_char
+        self.min_ms = min_ms
+        self.realtime = realtime
+        self.requests = 0
+
+    async def stream(self, request):
+        self.requests += 1
+        body = await request.json()
+        text = body.get("text", "")
+        audio = render_tone(max(self.min_ms, len(text) * self.ms_per_char))
+
+        response = web.StreamResponse(headers={"Content-Type": "audio/pcm"})
+        await response.prepare(request)
+        await asyncio.sleep(self.first_byte)
+        chunk_bytes = SAMPLE_RATE * 2 * CHUNK_MS // 1000
+        try:
+            for i in range(0, len(audio), chunk_bytes):
+                if i:
+                    await asyncio.sleep(CHUNK_MS / 1000.0 / self.realtime)
+                await response.write(audio[i:i + chunk_bytes])
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # the caller barged in or hung up; the client dropped the stream
+        return response
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/text-to-speech/{voice_id}/stream", self.stream)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--first-byte-ms", type=int, default=250, help="delay before the first audio chunk")
+    parser.add_argument("--ms-per-char", type=int, default=60, help="rendered audio per character of text")
+    parser.add_argument("--realtime", type=float, default=4.0, help="streaming speed as a multiple of playback")
+    args = parser.parse_args()
+
+    fake = FakeElevenLabs(args.first_byte_ms, args.ms_per_char, realtime=args.realtime)
+    web.run_app(fake.make_app(), host="127.0.0.1", port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
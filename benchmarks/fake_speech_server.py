@@ -0,0 +1,121 @@
+"""Local stand-in for Google Cloud Speech streaming recognition (plaintext gRPC).
+
+Serves google.cloud.speech.v1.Speech/StreamingRecognize. It endpoints the
+incoming audio with the same VAD the app uses. After a configurable delay
+it answers each utterance with the next scripted transcript. An interim
+result goes out as soon as speech starts. An END_OF_SINGLE_UTTERANCE event
+is sent when the config asks for single_utterance.
+
+Usage:
+    python benchmarks/fake_speech_server.py [--port 50051] [--delay-ms 150] [--transcripts "שלום,מה שמך"]
+
+Point the server under test at it with SPEECH_EMULATOR_HOST=127.0.0.1:50051.
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.cloud import speech
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vad import SPEECH_END, SPEECH_START, VoiceActivityDetector  # noqa: E402
+
+SERVICE = "google.cloud.speech.v1.Speech"
+DEFAULT_TRANSCRIPTS = ("שלום", "מה שמך", "ביי")
+
+
+def _result(transcript, is_final):
+    return speech.StreamingRecognizeResponse(
+        results=[speech.StreamingRecognitionResult(
+            alternatives=[speech.SpeechRecognitionAlternative(transcript=transcript, confidence=0.9)],
+            is_final=is_final,
+        )]
+    )
+
+
+class FakeSpeechServicer:
+    def __init__(self, transcripts=DEFAULT_TRANSCRIPTS, delay_ms=150):
+        self._transcripts = itertools.cycle(transcripts)
+        self._lock = threading.Lock()
+        self.delay = delay_ms / 1000.0
+        self.streams = 0
+        self.audio_bytes = 0
+
+    def _next_transcript(self):
+        with self._lock:
+            self.streams += 1
+            return next(self._transcripts)
+
+    def streaming_recognize(self, request_iterator, context):
+        config = None
+        vad = VoiceActivityDetector()
+        transcript = None
+        heard_speech = False
+        for request in request_iterator:
+            if config is None and "streaming_config" in request:
+                config = request.streaming_config
+                continue
+            audio = request.audio_content
+            if not audio:
+                continue
+            self.audio_bytes += len(audio)
+            for event, _ in vad.process(audio):
+                if event == SPEECH_START and not heard_speech:
+                    heard_speech = True
+                    transcript = self._next_transcript()
+                    if config is None or config.interim_results:
+                        yield _result(transcript[:max(1, len(transcript) // 2)], is_final=False)
+                elif event == SPEECH_END and heard_speech:
+                    if config is not None and config.single_utterance:
+                        yield speech.StreamingRecognizeResponse(
+                            speech_event_type=speech.StreamingRecognizeResponse.SpeechEventType.END_OF_SINGLE_UTTERANCE
+                        )
+                    time.sleep(self.delay)
+                    yield _result(transcript, is_final=True)
+                    if config is None or config.single_utterance:
+                        return
+                    heard_speech = False
+
+        # Client half-closed (e.g. its own VAD ended the utterance) before we endpointed.
+        if heard_speech:
+            time.sleep(self.delay)
+            yield _result(transcript, is_final=True)
+
+
+def start_server(port=0, transcripts=DEFAULT_TRANSCRIPTS, delay_ms=150, max_workers=1024):
+    """Start the fake in background threads; returns ``(server, port, servicer)``."""
+    servicer = FakeSpeechServicer(transcripts, delay_ms)
+    handler = grpc.method_handlers_generic_handler(SERVICE, {
+        "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+            servicer.streaming_recognize,
+            request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+            response_serializer=speech.StreamingRecognizeResponse.serialize,
+        ),
+    })
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), maximum_concurrent_rpcs=max_workers)
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    return server, port, servicer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--delay-ms", type=int, default=150, help="delay between end of speech and the final result")
+    parser.add_argument("--transcripts", default=",".join(DEFAULT_TRANSCRIPTS), help="comma separated transcripts, used in turn")
+    args = parser.parse_args()
+
+    server, port, _ = start_server(args.port, args.transcripts.split(","), args.delay_ms)
+    print(f"Fake Speech server listening on 127.0.0.1:{port}")
+    server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Offline load test: N concurrent simulated calls against app.py or ws_server.py.
+
+Everything runs on this machine and needs no network access. The script
+starts:
+
+- fake_speech_server.py in place of Google Speech
+- fake_elevenlabs.py in place of ElevenLabs TTS
+- the chosen server engine, pointed at both fakes with
+  SPEECH_EMULATOR_HOST and ELEVENLABS_API_BASE
+
+It then drives concurrency stages with twilio_sim.py. For each stage it
+reports:
+
+- end-of-speech to first-audio latency at p50, p95 and p99
+- outbound frame jitter
+- server CPU seconds and RSS per call
+- the error rate
+
+The results are written to a JSON file. Keep them next to the commit they
+were measured on; the file records that commit.
+
+Usage:
+    python benchmarks/loadtest.py --engine app --stages 1,5,10,25
+    python benchmarks/loadtest.py --engine ws_server --workers 2 --stages 10,50 --tts-cache
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+from twilio_sim import CallScript, run_calls, summarize  # noqa: E402
+
+FAKE_VOICE_ID = "LoadTestVoice0000000"  # 20 chars, so the client does not look it up by name
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0, proc=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{proc.args} exited with {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"nothing listening on port {port} after {timeout}s")
+
+
+def process_tree(pid):
+    """``pid`` and all of its descendants (ws_server forks one worker per core)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(children.get(p, []))
+    return tree
+
+
+def sample_usage(pid):
+    """``(cpu_seconds, rss_bytes)`` summed over the process tree."""
+    cpu = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{p}/statm") as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        cpu += int(fields[11]) + int(fields[12])  # utime + stime
+    return cpu / CLOCK_TICKS, rss
+
+
+class UsageMonitor(threading.Thread):
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, sample_usage(self.pid)[1])
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_processes(args, log):
+    speech_port, tts_port, port = free_port(), free_port(), free_port()
+    procs = [
+        subprocess.Popen([sys.executable, os.path.join(BENCH, "fake_speech_server.py"), "--port", str(speech_port),
+                          "--delay-ms", str(args.stt_delay_ms)], stdout=log, stderr=log),
+        subprocess.Popen([sys.executable, os.path.join(BENCH, "fake_elevenlabs.py"), "--port", str(tts_port),
+                          "--first-byte-ms", str(args.tts_first_byte_ms)], stdout=log, stderr=log),
+    ]
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        SPEECH_EMULATOR_HOST=f"127.0.0.1:{speech_port}",
+        ELEVENLABS_API_BASE=f"http://127.0.0.1:{tts_port}",
+        ELEVENLABS_API_KEY="loadtest",
+        ELEVENLABS_VOICE_ID=FAKE_VOICE_ID,
+        WEBSOCKET_STREAM_URL=f"ws://127.0.0.1:{port}/stream",
+    )
+    env.pop("GCP_CREDENTIALS_JSON", None)
+    if not args.tts_cache:
+        env.update(TTS_CACHE_DIR="", TTS_CACHE_MAX_ENTRIES="0")
+    command = [sys.executable, os.path.join(ROOT, f"{args.engine}.py")]
+    if args.engine == "ws_server":
+        command += ["--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers)]
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=log)
+    procs.append(server)
+
+    wait_for_port(speech_port, proc=procs[0])
+    wait_for_port(tts_port, proc=procs[1])
+    wait_for_port(port, timeout=60.0, proc=server)
+    return server, port, procs
+
+
+def run_stage(calls, script, server, port, args):
+    if args.engine == "app":
+        targets = {"voice_url": f"http://127.0.0.1:{port}/voice"}
+    else:  # ws_server only serves /stream
+        targets = {"ws_url": f"ws://127.0.0.1:{port}/stream"}
+
+    cpu_before, rss_before = sample_usage(server.pid)
+    monitor = UsageMonitor(server.pid)
+    monitor.start()
+    started = time.monotonic()
+    results = asyncio.run(run_calls(script, calls, ramp_seconds=args.ramp_seconds, **targets))
+    wall = time.monotonic() - started
+    monitor.stop()
+    cpu_after, _ = sample_usage(server.pid)
+
+    summary = summarize(results)
+    summary.update(
+        wall_s=round(wall, 2),
+        cpu_s=round(cpu_after - cpu_before, 3),
+        cpu_s_per_call=round((cpu_after - cpu_before) / calls, 4),
+        peak_rss_mb=round(monitor.peak_rss / 2**20, 1),
+        rss_mb_per_call=round(max(0, monitor.peak_rss - rss_before) / 2**20 / calls, 3),
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", choices=("app", "ws_server"), default="app")
+    parser.add_argument("--workers", type=int, default=1, help="ws_server worker processes")
+    parser.add_argument("--stages", default="1,5,10", help="comma separated concurrent call counts")
+    parser.add_argument("--turns", type=int, default=3, help="utterances per simulated call")
+    parser.add_argument("--recording", help="caller audio instead of the synthetic script (see twilio_sim.py)")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0)
+    parser.add_argument("--stt-delay-ms", type=int, default=150)
+    parser.add_argument("--tts-first-byte-ms", type=int, default=250)
+    parser.add_argument("--tts-cache", action="store_true", help="leave the server's TTS cache enabled")
+    parser.add_argument("--output", default="loadtest-results.json")
+    parser.add_argument("--log", default="loadtest-server.log", help="stdout/stderr of the spawned processes")
+    args = parser.parse_args()
+
+    script = CallScript.from_recording(args.recording) if args.recording else CallScript.synthetic(turns=args.turns)
+    report = {
+        "commit": git_commit(),
+        "engine": args.engine,
+        "args": vars(args),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": [],
+    }
+    with open(args.log, "ab") as log:
+        server, port, procs = start_processes(args, log)
+        try:
+            time.sleep(1.0)  # let start-up work (e.g. TTS pre-warm) settle before measuring
+            for calls in (int(n) for n in args.stages.split(",")):
+                stage = run_stage(calls, script, server, port, args)
+                report["stages"].append(stage)
+                latency, jitter = stage["latency_ms"], stage["jitter_ms"]
+                print(
+                    f"{calls:4d} calls: latency p50 {latency['p50']} p95 {latency['p95']} p99 {latency['p99']} ms | "
+                    f"jitter p95 {jitter['p95']} ms | {stage['cpu_s_per_call']} CPU s/call | "
+                    f"{stage['rss_mb_per_call']} MB/call | errors {stage['error_rate']:.1%}",
+                    flush=True,
+                )
+        finally:
+            for proc in reversed(procs):
+                proc.terminate()
+            for proc in procs:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Stream archived call recordings back through the recognition path.
+
+Each recording is the stereo WAV written by recording.py; the caller
+channel is replayed. Raw mu-law and the other formats vad_replay.py reads
+work too. Audio is fed as 20 ms Twilio 'media' messages into a real
+CallSession. The session uses app.py's settings, so the replay goes through
+the same VAD gating, coalescing and stream handovers as a live call, and
+uses the same Speech client: Google, or SPEECH_EMULATOR_HOST when set.
+
+The transcripts that come back are compared with the 'transcript' lines
+of the recording's JSONL sidecar, giving a word error rate over the whole
+call. The bot's answers are compared with the recorded 'response' lines.
+Differences point at changes in recognition, VAD tuning or intents
+between the recorded run and this one.
+
+Usage:
+    python benchmarks/replay_recordings.py recordings/2026-10-17/*.wav [--speed 4] [--json]
+    SPEECH_EMULATOR_HOST=127.0.0.1:50051 python benchmarks/replay_recordings.py call.wav
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import base64  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402  (also sets up grpc for gevent)
+from audio_codec import FRAME_BYTES, MULAW_SILENCE, OUTPUT_RATE  # noqa: E402
+from bot import get_bot_response  # noqa: E402
+from call_session import CallSession  # noqa: E402
+from intents import normalize_hebrew  # noqa: E402
+from media_scheduler import OutboundScheduler  # noqa: E402
+from telemetry import CallTrace  # noqa: E402
+from vad_replay import FRAME_SECONDS, read_recording  # noqa: E402
+
+STREAM_SID = "MZreplay"
+
+
+def _message(data):
+    return json.dumps(data, separators=(",", ":"))  # Twilio's compact form, which the fast parser expects
+
+
+class ReplaySocket:
+    """Stands in for Twilio's WebSocket: plays a recording in, discards what the bot sends.
+
+    Frames go out at ``speed`` times real time (0 for as fast as possible).
+    ``tail_ms`` of silence follows the recording so the VAD can close the
+    last utterance. 'stop' is sent ``settle_seconds`` later, giving Speech
+    time to return the final result.
+    """
+
+    def __init__(self, audio, call_sid, speed=1.0, tail_ms=1500, settle_seconds=2.0):
+        self.audio = audio + bytes([MULAW_SILENCE]) * (tail_ms * FRAME_BYTES // 20)
+        self.call_sid = call_sid
+        self.speed = speed
+        self.settle_seconds = settle_seconds
+        self.closed = False
+        self._messages = self._script()
+
+    def _script(self):
+        yield _message({"event": "connected", "protocol": "Call", "version": "1.0.0"})
+        yield _message({"event": "start", "streamSid": STREAM_SID, "start": {"streamSid": STREAM_SID, "callSid": self.call_sid}})
+        started = time.monotonic()
+        for number, offset in enumerate(range(0, len(self.audio) - FRAME_BYTES + 1, FRAME_BYTES)):
+            due = started + number * FRAME_SECONDS / self.speed if self.speed > 0 else 0
+            gevent.sleep(max(0.0, due - time.monotonic()))
+            payload = base64.b64encode(self.audio[offset:offset + FRAME_BYTES]).decode("ascii")
+            yield _message({"event": "media", "streamSid": STREAM_SID, "media": {"payload": payload}})
+        gevent.sleep(self.settle_seconds)
+        yield _message({"event": "stop", "streamSid": STREAM_SID})
+
+    def receive(self):
+        return next(self._messages, None)
+
+    def send(self, message):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def read_sidecar(path):
+    """Recorded transcripts and responses from a recording's JSONL sidecar (empty lists without one)."""
+    sidecar = os.path.splitext(path)[0] + ".jsonl"
+    transcripts, responses = [], []
+    if os.path.exists(sidecar):
+        with open(sidecar, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("event") == "transcript":
+                    transcripts.append(record["text"])
+                elif record.get("event") == "response":
+                    responses.append(record["text"])
+    return transcripts, responses
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance between two word lists."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+
+def replay(path, channel, speed, tail_ms, settle_seconds):
+    audio = read_recording(path, channel)
+    call_sid = "CAreplay-" + os.path.splitext(os.path.basename(path))[0]
+    ws = ReplaySocket(audio, call_sid, speed, tail_ms, settle_seconds)
+    scheduler = OutboundScheduler(ws, STREAM_SID).start()
+    transcripts, responses = [], []
+
+    def respond(text):
+        transcripts.append(text)
+        responses.append(get_bot_response(text))
+        return responses[-1]
+
+    session = CallSession(
+        ws,
+        scheduler,
+        app.warm_path.speech_client(),
+        app.make_streaming_config(),
+        get_bot_response=respond,
+        synthesize=lambda text: iter(()),  # no TTS: only the recognition path is under test
+        tts_available=lambda text: True,
+        stream_limit_seconds=app.STT_STREAM_LIMIT_SECONDS,
+        overlap_ms=app.STT_STREAM_OVERLAP_MS,
+        coalesce_ms=app.INGEST_COALESCE_MS,
+        buffer_seconds=app.INGEST_BUFFER_SECONDS,
+        vad_config=app.VAD_CONFIG,
+        trace=CallTrace(log_sample_rate=0),
+    )
+    started = time.monotonic()
+    try:
+        session.run()
+    finally:
+        session.close()
+        scheduler.stop()
+    return transcripts, responses, len(audio) / OUTPUT_RATE, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recordings", nargs="+", help="recorded calls (stereo WAV from recording.py, or mono audio)")
+    parser.add_argument("--channel", type=int, default=0, help="channel holding the caller (default 0)")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed; 0 sends as fast as possible")
+    parser.add_argument("--tail-ms", type=int, default=1500, help="silence appended after each recording")
+    parser.add_argument("--settle-seconds", type=float, default=2.0, help="wait for results before 'stop'")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    args = parser.parse_args()
+
+    if app.warm_path.speech_client() is None:
+        sys.exit("No Speech client: set GCP_CREDENTIALS_JSON or SPEECH_EMULATOR_HOST.")
+
+    results = []
+    total_words = total_errors = 0
+    for path in args.recordings:
+        expected, expected_responses = read_sidecar(path)
+        transcripts, responses, audio_seconds, wall_seconds = replay(
+            path, args.channel, args.speed, args.tail_ms, args.settle_seconds
+        )
+        reference = normalize_hebrew(" ".join(expected)).split()
+        errors = word_errors(reference, normalize_hebrew(" ".join(transcripts)).split())
+        total_words += len(reference)
+        total_errors += errors
+        results.append({
+            "recording": path,
+            "audio_seconds": round(audio_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "utterances_recorded": len(expected),
+            "utterances_replayed": len(transcripts),
+            "word_error_rate": round(errors / len(reference), 4) if reference else None,
+            "responses_changed": sum(a != b for a, b in zip(expected_responses, responses))
+            + abs(len(expected_responses) - len(responses)),
+            "transcripts": transcripts,
+            "recorded_transcripts": expected,
+        })
+
+    summary = {
+        "recordings": results,
+        "word_error_rate": round(total_errors / total_words, 4) if total_words else None,
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+        return
+    for r in results:
+        print(
+            f"{r['recording']}: {r['utterances_replayed']}/{r['utterances_recorded']} utterances | "
+            f"WER {r['word_error_rate']} | {r['responses_changed']} responses changed | "
+            f"{r['audio_seconds']}s audio in {r['wall_seconds']}s"
+        )
+        for got, want in zip(r["transcripts"], r["recorded_transcripts"]):
+            if normalize_hebrew(got) != normalize_hebrew(want):
+                print(f"    recorded {want!r} -> replayed {got!r}")
+    print(f"overall WER: {summary['word_error_rate']}")
+
+
+if __name__ == "__main__":
+    main()
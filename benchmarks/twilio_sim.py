@@ -0,0 +1,314 @@
+"""Simulated Twilio calls against a running server, with latency measurement.
+
+Each call goes through the same steps as a real one:
+
+1. POST /voice and read the <Stream> URL from the TwiML (skipped with --ws-url).
+2. Open the Media Streams WebSocket.
+3. Send 'connected' and 'start', then caller audio in real time as 20 ms
+   'media' messages, then 'stop'.
+
+Marks are echoed back when the simulated playout reaches them. Pending marks
+are returned at once on 'clear', which is what Twilio does.
+
+Per turn it measures latency from the end of the caller's speech to the
+first outbound media frame. For outbound frames it measures jitter, the
+difference between each inter-arrival time and 20 ms. The first frames of
+each burst are skipped because the server sends them ahead on purpose.
+
+Caller audio is a synthetic voiced/silent script by default. A recording
+can be used instead: raw mu-law or WAV, with Audacity labels marking where
+the speech ends (see vad_replay.py).
+
+Usage:
+    python benchmarks/twilio_sim.py --voice-url http://127.0.0.1:8080/voice --calls 5
+    python benchmarks/twilio_sim.py --ws-url ws://127.0.0.1:8080/stream --recording call.wav
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+import aiohttp
+import numpy as np
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_codec import FRAME_BYTES, OUTPUT_RATE, mulaw_encode  # noqa: E402
+
+FRAME_SECONDS = FRAME_BYTES / OUTPUT_RATE
+# Talisman redirects plain-http requests; the real app sits behind a TLS proxy.
+PROXY_HEADERS = {"X-Forwarded-Proto": "https"}
+BURST_GAP_SECONDS = 0.2
+DRAIN_SECONDS = 1.0  # keep listening this long after 'stop'
+
+
+class CallScript:
+    """Caller audio plus the offsets (seconds) at which each utterance ends."""
+
+    def __init__(self, audio, speech_ends):
+        self.audio = audio
+        self.speech_ends = speech_ends
+
+    @property
+    def duration(self):
+        return len(self.audio) / OUTPUT_RATE
+
+    @classmethod
+    def synthetic(cls, turns=3, lead_ms=1000, speech_ms=1200, gap_ms=3500, seed=0):
+        rng = np.random.default_rng(seed)
+
+        def silence(ms):
+            return rng.normal(0, 30, OUTPUT_RATE * ms // 1000)
+
+        def voiced(ms):
+            t = np.arange(OUTPUT_RATE * ms // 1000) / OUTPUT_RATE
+            tone = sum(np.sin(2 * np.pi * 140 * h * t) / h for h in range(1, 6))
+            return tone * 5000 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+
+        parts, ends, offset = [silence(lead_ms)], [], lead_ms
+        for _ in range(turns):
+            parts += [voiced(speech_ms), silence(gap_ms)]
+            offset += speech_ms
+            ends.append(offset / 1000)
+            offset += gap_ms
+        pcm = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+        return cls(mulaw_encode(pcm), ends)
+
+    @classmethod
+    def from_recording(cls, path, channel=0, labels=None):
+        from vad_replay import read_labels, read_recording
+
+        audio = read_recording(path, channel)
+        segments = read_labels(labels or os.path.splitext(path)[0] + ".txt")
+        return cls(audio, [end for _, end in segments])
+
+
+def _dumps(message):
+    # Twilio sends compact JSON; the server's fast-path parser relies on it.
+    return json.dumps(message, separators=(",", ":"))
+
+
+async def _stream_url(session, voice_url, call_sid):
+    form = {"CallSid": call_sid, "From": "+15005550006", "To": "+15005550001"}
+    async with session.post(voice_url, data=form, headers=PROXY_HEADERS) as response:
+        response.raise_for_status()
+        twiml = await response.text()
+    match = re.search(r'<Stream[^>]*\burl="([^"]+)"', twiml)
+    if not match:
+        raise ValueError(f"no <Stream> in TwiML: {twiml!r}")
+    return match.group(1)
+
+
+class SimulatedCall:
+    def __init__(self, script, voice_url=None, ws_url=None, ws_override=None, lead_frames=3, turn_timeout=8.0):
+        self.script = script
+        self.voice_url = voice_url
+        self.ws_url = ws_url
+        self.ws_override = ws_override  # connect here even if the TwiML points elsewhere
+        self.lead_frames = lead_frames
+        self.turn_timeout = turn_timeout
+        self.call_sid = "CA" + uuid.uuid4().hex
+        self.stream_sid = "MZ" + uuid.uuid4().hex
+        self.media_times = []
+        self.marks_echoed = 0
+        self.clears = 0
+        self.error = None
+        self.started = None
+        self._playout_end = 0.0
+        self._pending_marks = []
+
+    async def run(self, session):
+        try:
+            url = self.ws_url
+            if self.voice_url:
+                url = await _stream_url(session, self.voice_url, self.call_sid)
+            async with connect(self.ws_override or url, additional_headers=PROXY_HEADERS, compression=None) as ws:
+                receiver = asyncio.create_task(self._receive(ws))
+                try:
+                    self.started = await self._send(ws)
+                    await asyncio.sleep(DRAIN_SECONDS)
+                finally:
+                    receiver.cancel()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        return self
+
+    async def _send(self, ws):
+        await ws.send(_dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+        await ws.send(_dumps({
+            "event": "start",
+            "sequenceNumber": "1",
+            "start": {
+                "streamSid": self.stream_sid,
+                "callSid": self.call_sid,
+                "tracks": ["inbound"],
+                "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": OUTPUT_RATE, "channels": 1},
+            },
+            "streamSid": self.stream_sid,
+        }))
+        audio = self.script.audio
+        t0 = time.monotonic()
+        for n, offset in enumerate(range(0, len(audio) - FRAME_BYTES + 1, FRAME_BYTES)):
+            delay = t0 + n * FRAME_SECONDS - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send(_dumps({
+                "event": "media",
+                "sequenceNumber": str(n + 2),
+                "media": {
+                    "track": "inbound",
+                    "chunk": str(n + 1),
+                    "timestamp": str(n * 20),
+                    "payload": base64.b64encode(audio[offset:offset + FRAME_BYTES]).decode("ascii"),
+                },
+                "streamSid": self.stream_sid,
+            }))
+        await ws.send(_dumps({"event": "stop", "streamSid": self.stream_sid, "stop": {"callSid": self.call_sid}}))
+        return t0
+
+    async def _echo_marks(self, ws):
+        now = time.monotonic()
+        while self._pending_marks and (self._pending_marks[0][0] <= now):
+            _, name = self._pending_marks.pop(0)
+            await ws.send(_dumps({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": name}}))
+            self.marks_echoed += 1
+
+    async def _receive(self, ws):
+        try:
+            await self._receive_loop(ws)
+        except ConnectionClosed:
+            pass
+
+    async def _receive_loop(self, ws):
+        while True:
+            timeout = None
+            if self._pending_marks:
+                timeout = max(0.0, self._pending_marks[0][0] - time.monotonic())
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout)
+            except asyncio.TimeoutError:
+                await self._echo_marks(ws)
+                continue
+            now = time.monotonic()
+            data = json.loads(message)
+            event = data.get("event")
+            if event == "media":
+                self.media_times.append(now)
+                self._playout_end = max(now, self._playout_end) + FRAME_SECONDS
+            elif event == "mark":
+                self._pending_marks.append((max(now, self._playout_end), data["mark"]["name"]))
+            elif event == "clear":
+                self.clears += 1
+                self._playout_end = now
+                self._pending_marks = [(now, name) for _, name in self._pending_marks]
+            await self._echo_marks(ws)
+
+    def results(self):
+        """Per-turn latencies (ms, None when the bot never answered) and jitter samples (ms)."""
+        if self.error or self.started is None:
+            return {"error": self.error or "call did not start", "latencies_ms": [], "jitter_ms": []}
+
+        times = np.array(self.media_times)
+        latencies = []
+        for i, end in enumerate(self.script.speech_ends):
+            end_at = self.started + end
+            deadline = end_at + self.turn_timeout
+            if i + 1 < len(self.script.speech_ends):
+                deadline = min(deadline, self.started + self.script.speech_ends[i + 1])
+            replies = times[(times > end_at) & (times <= deadline)]
+            latencies.append(round((replies[0] - end_at) * 1000, 1) if len(replies) else None)
+
+        jitter = []
+        if len(times) > 1:
+            deltas = np.diff(times)
+            burst_index = 0
+            for delta in deltas:
+                if delta > BURST_GAP_SECONDS:
+                    burst_index = 0
+                    continue
+                burst_index += 1
+                if burst_index >= self.lead_frames:
+                    jitter.append(abs(delta - FRAME_SECONDS) * 1000)
+        return {"error": None, "latencies_ms": latencies, "jitter_ms": jitter}
+
+
+async def run_calls(script, count, voice_url=None, ws_url=None, ws_override=None, ramp_seconds=1.0, **kwargs):
+    """Run ``count`` concurrent calls, started evenly over ``ramp_seconds``; returns SimulatedCall objects."""
+    calls = [SimulatedCall(script, voice_url, ws_url, ws_override, **kwargs) for _ in range(count)]
+
+    async def start(call, delay, session):
+        await asyncio.sleep(delay)
+        return await call.run(session)
+
+    async with aiohttp.ClientSession() as session:
+        step = ramp_seconds / count if count else 0
+        await asyncio.gather(*(start(call, i * step, session) for i, call in enumerate(calls)))
+    return calls
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if len(values) else None
+
+
+def summarize(calls):
+    latencies, jitter, errors, missed = [], [], 0, 0
+    error_samples = []
+    for call in calls:
+        result = call.results()
+        if result["error"]:
+            errors += 1
+            error_samples.append(result["error"])
+            continue
+        for latency in result["latencies_ms"]:
+            if latency is None:
+                missed += 1
+            else:
+                latencies.append(latency)
+        jitter.extend(result["jitter_ms"])
+    turns = len(latencies) + missed
+    return {
+        "calls": len(calls),
+        "failed_calls": errors,
+        "turns": turns,
+        "unanswered_turns": missed,
+        "error_rate": round((errors + missed) / max(1, len(calls) + turns), 4),
+        "latency_ms": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+                       "p99": _percentile(latencies, 99), "max": _percentile(latencies, 100)},
+        "jitter_ms": {"mean": round(float(np.mean(jitter)), 2) if jitter else None,
+                      "p95": _percentile(jitter, 95), "p99": _percentile(jitter, 99)},
+        "clears": sum(call.clears for call in calls),
+        "errors": sorted(set(error_samples))[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--voice-url", help="POST /voice here and follow the TwiML <Stream> URL")
+    target.add_argument("--ws-url", help="connect straight to this Media Streams WebSocket")
+    parser.add_argument("--ws-override", help="connect here instead of the URL in the TwiML")
+    parser.add_argument("--calls", type=int, default=1)
+    parser.add_argument("--ramp-seconds", type=float, default=1.0)
+    parser.add_argument("--turns", type=int, default=3, help="utterances in the synthetic script")
+    parser.add_argument("--recording", help="caller audio file instead of the synthetic script")
+    parser.add_argument("--labels", help="speech labels for --recording (default: <recording>.txt)")
+    parser.add_argument("--channel", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.recording:
+        script = CallScript.from_recording(args.recording, args.channel, args.labels)
+    else:
+        script = CallScript.synthetic(turns=args.turns)
+    calls = asyncio.run(run_calls(script, args.calls, args.voice_url, args.ws_url, args.ws_override, args.ramp_seconds))
+    print(json.dumps(summarize(calls), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Replay recorded calls through the VAD and score its decisions.
+
+Each recording is 8 kHz mono/stereo audio. Supported formats are raw
+mu-law (.ulaw / .mulaw / .raw) and WAV (PCM16 or mu-law). Labels are
+Audacity label tracks: one ``start<TAB>end[<TAB>text]`` line per speech
+segment, in seconds. By default they are read from the recording path with
+its extension replaced by ``.txt``; the tool stops if one is missing.
+Recordings from recording.py need such a label track made for them, as
+their JSONL sidecar has no segment bounds.
+
+Usage:
+    python benchmarks/vad_replay.py calls/*.wav [--channel 0] [--json]
+    VAD_HANGOVER_MS=400 python benchmarks/vad_replay.py call.ulaw --labels call.txt
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_codec import FRAME_BYTES, OUTPUT_RATE, mulaw_encode  # noqa: E402
+from vad import SPEECH_END, SPEECH_START, VADConfig, VoiceActivityDetector  # noqa: E402
+
+FRAME_SECONDS = FRAME_BYTES / OUTPUT_RATE
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_MULAW = 7
+
+
+def read_wav_mulaw(path, channel):
+    """Read one channel of an 8 kHz PCM16 or mu-law WAV file as mu-law bytes."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError(f"{path}: not a WAV file")
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, offset)
+        body = data[offset + 8:offset + 8 + size]
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", body)
+        elif chunk_id == b"data":
+            break
+        offset += 8 + size + (size & 1)
+    else:
+        raise ValueError(f"{path}: no data chunk")
+    if fmt is None:
+        raise ValueError(f"{path}: no fmt chunk")
+
+    audio_format, channels, rate, _, _, bits = fmt
+    if rate != OUTPUT_RATE:
+        raise ValueError(f"{path}: expected {OUTPUT_RATE} Hz, got {rate} Hz")
+    if channel >= channels:
+        raise ValueError(f"{path}: has {channels} channel(s), asked for channel {channel}")
+    if audio_format == WAVE_FORMAT_MULAW and bits == 8:
+        return np.frombuffer(body, dtype=np.uint8)[channel::channels].tobytes()
+    if audio_format == WAVE_FORMAT_PCM and bits == 16:
+        return mulaw_encode(np.frombuffer(body[:len(body) & ~1], dtype="<i2")[channel::channels].copy())
+    raise ValueError(f"{path}: unsupported WAV format {audio_format} ({bits} bit)")
+
+
+def read_recording(path, channel):
+    if path.lower().endswith(".wav"):
+        return read_wav_mulaw(path, channel)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_labels(path):
+    segments = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and not line.startswith("\\"):
+                segments.append((float(parts[0]), float(parts[1])))
+    return segments
+
+
+def labels_to_frames(segments, num_frames):
+    truth = np.zeros(num_frames, dtype=bool)
+    for start, end in segments:
+        truth[int(start / FRAME_SECONDS):int(np.ceil(end / FRAME_SECONDS))] = True
+    return truth
+
+
+def replay(audio, config):
+    """Feed audio frame by frame, as the live path does; return decisions, events and CPU time."""
+    vad = VoiceActivityDetector(config)
+    decisions = []
+    events = []
+    cpu = 0.0
+    for frame_index, offset in enumerate(range(0, len(audio) - FRAME_BYTES + 1, FRAME_BYTES)):
+        frame = audio[offset:offset + FRAME_BYTES]
+        t0 = time.process_time()
+        for event, pos in vad.process(frame, decisions):
+            events.append((event, pos // FRAME_BYTES, frame_index))
+        cpu += time.process_time() - t0
+    return np.array(decisions, dtype=bool), events, cpu
+
+
+def score(decisions, events, segments):
+    truth = labels_to_frames(segments, len(decisions))
+    tp = int(np.count_nonzero(decisions & truth))
+    fp = int(np.count_nonzero(decisions & ~truth))
+    fn = int(np.count_nonzero(~decisions & truth))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+
+    # Event-level: how late did we detect each labelled utterance's start and end?
+    starts = [detected for event, _, detected in events if event == SPEECH_START]
+    ends = [detected for event, _, detected in events if event == SPEECH_END]
+    onset_delays, end_delays, missed = [], [], 0
+    for start, end in segments:
+        first, last = int(start / FRAME_SECONDS), int(np.ceil(end / FRAME_SECONDS))
+        hits = [d for d in starts if first <= d <= last]
+        if not hits:
+            missed += 1
+            continue
+        onset_delays.append((hits[0] - first) * FRAME_SECONDS * 1000)
+        later_ends = [d for d in ends if d >= last]
+        if later_ends:
+            end_delays.append((later_ends[0] - last) * FRAME_SECONDS * 1000)
+    false_starts = sum(1 for d in starts if not truth[max(0, d - 10):d + 1].any())
+
+    return {
+        "frames": len(decisions),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        "utterances": len(segments),
+        "missed_utterances": missed,
+        "false_starts": false_starts,
+        "onset_delay_ms_mean": round(float(np.mean(onset_delays)), 1) if onset_delays else None,
+        "end_of_utterance_delay_ms_mean": round(float(np.mean(end_delays)), 1) if end_delays else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recordings", nargs="+", help="recorded call audio files")
+    parser.add_argument("--labels", help="label file (only with a single recording)")
+    parser.add_argument("--channel", type=int, default=0, help="WAV channel holding the caller (default 0)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    args = parser.parse_args()
+    if args.labels and len(args.recordings) > 1:
+        parser.error("--labels can only be used with a single recording")
+    label_files = [args.labels or os.path.splitext(path)[0] + ".txt" for path in args.recordings]
+    missing = [labels for labels in label_files if not os.path.exists(labels)]
+    if missing:
+        # Archived calls (recording.py) have no labels: their JSONL sidecar has no speech segment bounds.
+        parser.error(
+            f"no label file for {len(missing)} recording(s): {', '.join(missing)}. "
+            "Export an Audacity label track of the caller's speech next to each recording, or pass --labels."
+        )
+
+    config = VADConfig.from_env()
+    results = []
+    total_frames = 0
+    total_cpu = 0.0
+    for path, labels in zip(args.recordings, label_files):
+        audio = read_recording(path, args.channel)
+        decisions, events, cpu = replay(audio, config)
+        result = {"recording": path, **score(decisions, events, read_labels(labels))}
+        result["cpu_us_per_frame"] = round(cpu / max(1, len(decisions)) * 1e6, 2)
+        results.append(result)
+        total_frames += len(decisions)
+        total_cpu += cpu
+
+    summary = {
+        "config": vars(config),
+        "recordings": results,
+        "cpu_us_per_frame": round(total_cpu / max(1, total_frames) * 1e6, 2),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(config)
+    for r in results:
+        print(
+            f"{r['recording']}: P={r['precision']:.3f} R={r['recall']:.3f} F1={r['f1']:.3f} | "
+            f"utterances {r['utterances']} missed {r['missed_utterances']} false starts {r['false_starts']} | "
+            f"onset +{r['onset_delay_ms_mean']} ms, end +{r['end_of_utterance_delay_ms_mean']} ms | "
+            f"{r['cpu_us_per_frame']} us/frame"
+        )
+    print(f"overall: {summary['cpu_us_per_frame']} us CPU per 20 ms frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import logging
+import os
+
+from intents import IntentEngine
+
+logger = logging.getLogger(__name__)
+
+# --- Bot Logic ---
+# Intents, trigger phrases and responses live in a data file that is reloaded when it changes
+INTENTS_PATH = os.environ.get("INTENTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json"))
+INTENTS_RELOAD_SECONDS = float(os.environ.get("INTENTS_RELOAD_SECONDS", 2))
+
+engine = IntentEngine(INTENTS_PATH, reload_interval=INTENTS_RELOAD_SECONDS)
+
+# Every fixed sentence get_bot_response() can return; rendered ahead of time by prewarm_tts_cache().
+# Refreshed when the intents file is reloaded, so read it as bot.BOT_RESPONSES.
+BOT_RESPONSES = engine.index.static_responses()
+
+def _refresh_responses(index):
+    global BOT_RESPONSES
+    BOT_RESPONSES = index.static_responses()
+
+engine.on_reload.append(_refresh_responses)
+
+def on_responses_changed(callback):
+    """Call ``callback()`` after a reload has refreshed BOT_RESPONSES (e.g. to pre-warm the TTS cache)."""
+    engine.on_reload.append(lambda index: callback())
+
+def is_static_response(text):
+    """False for replies rendered with slot values (e.g. the caller's name), which are not worth caching."""
+    return engine.index.is_static_response(text)
+
+def get_bot_response(text):
+    logger.debug(f"User: {text}")
+    return engine.respond(text)
@@ -0,0 +1,392 @@
+import binascii
+import functools
+import json
+import logging
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.pool import Group
+from gevent.queue import Queue
+from google.cloud import speech
+
+from ingest import BYTES_PER_SECOND, AudioRingBuffer, decode_payload, parse_twilio_event
+from telemetry import CallTrace
+from vad import SPEECH_END, SPEECH_START, VoiceActivityDetector
+
+logger = logging.getLogger(__name__)
+
+STREAM_RETRY_SECONDS = 1.0
+
+
+class RecognitionStream:
+    """Cursor and state of one streaming_recognize call.
+
+    Holds the rules both engines (this module and ws_server.py) apply to
+    a stream; the engines only differ in how they wait and send.
+    """
+
+    def __init__(self, number, start_pos):
+        self.number = number
+        self.pos = start_pos
+        self.started = time.monotonic()
+        self.half_closed = False
+        self.stop_pos = None  # set by the VAD at end of utterance
+        self.turn = None  # CallTrace turn this stream's utterance belongs to
+
+    def advance(self, audio, pos, vad):
+        """Move the cursor over a buffer read ending at ``pos``; return ``(audio, held)``.
+
+        Nothing past the end of utterance, or with a VAD past its
+        ``forward_pos``, is sent: that trailing silence is cut off and
+        ``held`` is True.
+        """
+        limit = self.stop_pos
+        if limit is None and vad is not None:
+            limit = vad.forward_pos
+        held = limit is not None and pos > limit
+        if held:
+            audio = audio[:max(0, limit - self.pos)]
+            pos = max(self.pos, limit)
+        self.pos = pos
+        return audio, held
+
+    @property
+    def utterance_sent(self):
+        """Everything up to the local end of utterance has been sent; time to half-close."""
+        return self.stop_pos is not None and self.pos >= self.stop_pos
+
+
+def needs_new_stream(active_stream):
+    """Whether speech starting now has to open a stream rather than join ``active_stream``."""
+    return active_stream is None or active_stream.half_closed or active_stream.stop_pos is not None
+
+
+def continues_after_handover(stream, active_stream, vad):
+    """Whether a stream being half-closed is replaced by an overlapping one right away.
+
+    Without a VAD, always. With one, the next stream is opened on the next
+    speech start, unless the caller is still talking right now.
+    """
+    return vad is None or (vad.in_speech and stream is active_stream)
+
+
+class CallSession:
+    """Everything that lives for one Twilio media WebSocket.
+
+    Four greenlets connected by bounded queues:
+
+    * inbound:   WebSocket -> AudioRingBuffer (+ start/mark/stop events)
+    * recognize: AudioRingBuffer -> Google streaming_recognize -> transcripts
+    * bot:       transcripts -> get_bot_response -> replies
+    * playback:  replies -> TTS -> OutboundScheduler
+
+    Each recognition stream is half-closed after its final result, or
+    shortly before Google's streaming duration limit. A new stream is
+    started at that moment, reading from slightly before the old stream's
+    cursor. The two streams overlap, so no audio is lost at the handover.
+
+    Inbound 20 ms frames are coalesced into ``coalesce_ms`` worth of audio
+    per StreamingRecognizeRequest.
+
+    With a ``vad_config`` the session runs a local VAD on every inbound
+    frame. A stream is then opened only when speech starts, beginning at
+    the VAD's preroll. It is half-closed at the locally detected end of
+    utterance, so silence is never sent and Google finalizes without
+    waiting for its own endpointer. Barge-in fires on VAD speech start
+    rather than on interim results.
+
+    ``claim_prepared(call_sid)`` is called on Twilio's 'start' event. If it
+    returns the resources warmed up at /voice (see warm_path.PreparedCall),
+    their Speech client and streaming config replace the defaults.
+
+    Each utterance is timed as a ``trace`` turn. The turn travels with the
+    transcript and then the reply through the queues, from speech start to
+    the first outbound frame of the answer.
+
+    A ``recorder`` (recording.CallRecorder) gets a copy of every decoded
+    inbound frame, plus the call's start, transcripts, bot replies and
+    barge-ins for its sidecar. Outbound frames reach it through the
+    scheduler's tap.
+    """
+
+    def __init__(self, ws, scheduler, speech_client, streaming_config,
+                 get_bot_response, synthesize, tts_available,
+                 stream_limit_seconds=290, overlap_ms=300, coalesce_ms=100,
+                 buffer_seconds=10, queue_size=8, vad_config=None, trace=None, claim_prepared=None,
+                 recorder=None):
+        self.ws = ws
+        self.scheduler = scheduler
+        self.speech_client = speech_client
+        self.streaming_config = streaming_config
+        self.get_bot_response = get_bot_response
+        self.synthesize = synthesize
+        self.tts_available = tts_available
+        self.claim_prepared = claim_prepared
+        self.recorder = recorder
+        self.stream_limit_seconds = stream_limit_seconds
+        self.overlap_bytes = overlap_ms * BYTES_PER_SECOND // 1000
+        self.coalesce_bytes = max(1, coalesce_ms * BYTES_PER_SECOND // 1000)
+        self.coalesce_timeout = max(coalesce_ms, 20) / 1000.0 * 2
+
+        self.audio = AudioRingBuffer(buffer_seconds * BYTES_PER_SECOND)
+        self.vad = VoiceActivityDetector(vad_config) if vad_config is not None else None
+        self.trace = trace if trace is not None else CallTrace()
+        self._active_stream = None
+        self.transcripts = Queue(maxsize=queue_size)
+        self.replies = Queue(maxsize=queue_size)
+        self.closed = False
+        self._done = Event()
+        self._greenlets = Group()
+        self._stream_count = 0
+        self.turns = 0
+        self.frames_in = 0
+        self.decode_errors = 0
+        self.requests_sent = 0
+
+    # --- Lifecycle ---
+    def run(self):
+        """Run the session until the caller hangs up or Twilio sends 'stop'."""
+        self._greenlets.spawn(self._inbound_loop)
+        self._greenlets.spawn(self._bot_loop)
+        self._greenlets.spawn(self._playback_loop)
+        if self.vad is None:
+            self._start_stream(self.audio.end)
+        self._done.wait()
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.audio.close()
+        self._done.set()
+        self._greenlets.kill(block=False)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.scheduler.last_frame_at is not None:
+            self.trace.mark("last_outbound_frame", at=self.scheduler.last_frame_at)
+        self.trace.finish(
+            frames_in=self.frames_in,
+            frames_out=self.scheduler.frames_sent,
+            decode_errors=self.decode_errors,
+            dropped_bytes=self.audio.dropped_bytes,
+            barge_ins=self.scheduler.clears_sent,
+            recognition_streams=self._stream_count,
+            recognition_requests=self.requests_sent,
+            turns=self.turns,
+        )
+        logger.info(
+            f"Call session closed after {self.turns} turns and {self._stream_count} recognition streams: "
+            f"{self.frames_in} frames in, {self.requests_sent} recognition requests, "
+            f"{self.decode_errors} decode errors, {self.audio.dropped_bytes} bytes dropped."
+        )
+
+    # --- Inbound ---
+    def _inbound_loop(self):
+        if self.trace.log_sampled:
+            logger.debug("Starting WebSocket inbound reader...")
+        try:
+            while not self.ws.closed:
+                message = self.ws.receive()
+                if message is None:
+                    logger.warning("Received None message from WebSocket (client disconnected?).")
+                    break
+                event, payload = parse_twilio_event(message)
+                if event == "media":
+                    self.frames_in += 1
+                    if self.frames_in == 1:
+                        self.trace.mark("first_inbound_frame")
+                    try:
+                        audio = decode_payload(payload)
+                    except (binascii.Error, TypeError):
+                        self.decode_errors += 1
+                        continue
+                    self.audio.write(audio)
+                    if self.recorder is not None:
+                        self.recorder.inbound(audio)
+                    if self.vad is not None:
+                        for vad_event, pos in self.vad.process(audio):
+                            self._on_vad_event(vad_event, pos)
+                    continue
+
+                data = json.loads(message)
+                if event == "mark":
+                    self.scheduler.on_mark(data.get("mark", {}).get("name"))
+                elif event == "start":
+                    start = data.get("start", {})
+                    self.scheduler.stream_sid = data.get("streamSid") or start.get("streamSid", self.scheduler.stream_sid)
+                    self.trace.call_sid = start.get("callSid")
+                    self.trace.stream_sid = self.scheduler.stream_sid
+                    self.trace.mark("call_start")
+                    self._pick_up_prepared(start.get("callSid"))
+                    if self.recorder is not None:
+                        self.recorder.start(start.get("callSid"), self.scheduler.stream_sid)
+                    logger.info(f"Twilio 'start' event received: streamSid={self.scheduler.stream_sid} callSid={start.get('callSid')}")
+                elif event == "stop":
+                    logger.info(f"Twilio 'stop' event received: streamSid={data.get('streamSid')}")
+                    break
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON Decode Error in WebSocket message: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(f"Unexpected error in WebSocket inbound reader: {e}", exc_info=True)
+        finally:
+            if self.trace.log_sampled:
+                logger.debug("WebSocket inbound reader finished.")
+            self._done.set()
+
+    def _pick_up_prepared(self, call_sid):
+        if self.claim_prepared is None:
+            return
+        prepared = self.claim_prepared(call_sid)
+        if prepared is not None:
+            self.speech_client = prepared.speech_client
+            self.streaming_config = prepared.streaming_config
+
+    def _on_vad_event(self, vad_event, pos):
+        if vad_event == SPEECH_START:
+            if self.trace.log_sampled:
+                logger.debug(f"VAD speech start at byte {pos}.")
+            if self.scheduler.is_playing:
+                self.scheduler.barge_in()
+                if self.recorder is not None:
+                    self.recorder.event("barge_in")
+            stream = self._active_stream
+            if needs_new_stream(stream):
+                stream = self._start_stream(pos)
+            if stream is not None:
+                self.trace.mark("speech_start", self._turn(stream))
+        elif vad_event == SPEECH_END:
+            if self.trace.log_sampled:
+                logger.debug(f"VAD end of utterance at byte {pos}.")
+            stream = self._active_stream
+            if stream is not None and not stream.half_closed:
+                stream.stop_pos = pos
+                self.trace.mark("speech_end", self._turn(stream))
+
+    # --- Recognition ---
+    def _start_stream(self, start_pos):
+        if self.closed:
+            return
+        self._stream_count += 1
+        stream = RecognitionStream(self._stream_count, max(start_pos, self.audio.start))
+        self._active_stream = stream
+        self._greenlets.spawn(self._recognize, stream)
+        return stream
+
+    def _turn(self, stream):
+        if stream.turn is None:
+            stream.turn = self.trace.begin_turn()
+        return stream.turn
+
+    def _handover(self, stream, reason):
+        if stream.half_closed:
+            return
+        stream.half_closed = True
+        if self.trace.log_sampled:
+            logger.debug(f"Recognition stream #{stream.number} handing over ({reason}).")
+        if continues_after_handover(stream, self._active_stream, self.vad):
+            self._start_stream(stream.pos - self.overlap_bytes)
+
+    def _requests(self, stream):
+        while not stream.half_closed and not self.closed:
+            audio, pos = self.audio.read(stream.pos, timeout=self.coalesce_timeout, min_bytes=self.coalesce_bytes)
+            audio, held = stream.advance(audio, pos, self.vad)
+            if audio:
+                self.requests_sent += 1
+                yield speech.StreamingRecognizeRequest(audio_content=audio)
+            elif self.audio.closed:
+                break
+            elif held:
+                gevent.sleep(self.coalesce_timeout / 2)
+            if stream.utterance_sent:
+                # Local end of utterance: half-close so Google finalizes now.
+                break
+            if time.monotonic() - stream.started > self.stream_limit_seconds:
+                self._handover(stream, "duration limit")
+
+    def _recognize(self, stream):
+        if self.trace.log_sampled:
+            logger.debug(f"Opening recognition stream #{stream.number}...")
+        try:
+            responses = self.speech_client.streaming_recognize(self.streaming_config, self._requests(stream))
+            for response in responses:
+                if response.speech_event_type == speech.StreamingRecognizeResponse.SpeechEventType.END_OF_SINGLE_UTTERANCE:
+                    self._handover(stream, "end of utterance")
+                if not response.results or not response.results[0].alternatives:
+                    continue
+
+                result = response.results[0]
+                transcript = result.alternatives[0].transcript
+                if not result.is_final:
+                    self.trace.mark("first_interim", self._turn(stream))
+                    if self.vad is None and self.scheduler.is_playing and transcript.strip():
+                        self.scheduler.barge_in()
+                        if self.recorder is not None:
+                            self.recorder.event("barge_in")
+                    continue
+
+                turn = self._turn(stream)
+                self.trace.mark("final_transcript", turn)
+                if self.trace.log_sampled:
+                    logger.debug(f"Final transcript received: '{transcript}'")
+                self._handover(stream, "final result")
+                if transcript.strip():
+                    self.transcripts.put((transcript, turn))
+                stream.turn = None  # anything later on this stream is a new utterance
+        except Exception as e:
+            if not self.closed:
+                logger.error(f"Recognition stream #{stream.number} failed: {e}", exc_info=True)
+                if not stream.half_closed:
+                    # Don't spin if Google keeps rejecting the stream.
+                    gevent.sleep(STREAM_RETRY_SECONDS)
+        finally:
+            if not self.closed:
+                self._handover(stream, "stream ended")
+
+    # --- Bot logic and playback ---
+    def _bot_loop(self):
+        for transcript, turn in self.transcripts:
+            try:
+                reply = self.get_bot_response(transcript)
+            except Exception as e:
+                # One bad turn must not take the rest of the call down with it.
+                logger.error(f"Bot failed to answer '{transcript}': {e}", exc_info=True)
+                continue
+            self.trace.mark("bot_decision", turn)
+            if self.recorder is not None:
+                self.recorder.event("transcript", text=transcript)
+                self.recorder.event("response", text=reply)
+            self.replies.put((reply, turn))
+
+    def _first_frame_sent(self, turn):
+        self.trace.mark("first_outbound_frame", turn)
+        self.trace.mark("first_outbound_frame")
+
+    def _playback_loop(self):
+        for reply, turn in self.replies:
+            if not self.tts_available(reply):
+                logger.error("ElevenLabs client is not initialized. Cannot perform Text-to-Speech.")
+                continue
+            self.turns += 1
+            epoch = self.scheduler.epoch
+            # Notify Twilio that bot response is starting
+            self.scheduler.mark("bot_response_start")
+            self.trace.mark("tts_request", turn)
+            try:
+                first = True
+                for mulaw in self.synthesize(reply):
+                    if self.scheduler.epoch != epoch:
+                        if self.trace.log_sampled:
+                            logger.debug("Bot response interrupted by caller.")
+                        break
+                    if first:
+                        first = False
+                        self.trace.mark("tts_first_byte", turn)
+                        self.scheduler.when_reached(functools.partial(self._first_frame_sent, turn))
+                    self.scheduler.send_audio(mulaw)
+                else:
+                    self.scheduler.end_audio()
+                    self.scheduler.mark("bot_response_end")
+            except Exception as e:
+                logger.error(f"Error processing or sending audio chunk: {e}", exc_info=True)
@@ -0,0 +1,137 @@
+import binascii
+import json
+import logging
+
+from gevent.event import Event
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_SECOND = 8000  # 8 kHz mu-law, one byte per sample
+
+_EVENT_KEY = '"event":"'
+_PAYLOAD_KEY = '"payload":"'
+
+
+def parse_twilio_event(message):
+    """Return ``(event, payload)`` for a Twilio Media Streams message.
+
+    Media messages are by far the most frequent, so they are handled with
+    two ``str.find`` calls instead of a full JSON parse. ``payload`` is the
+    base64 text for media events and ``None`` otherwise. Anything that does
+    not look like Twilio's compact JSON falls back to ``json.loads``.
+    """
+    i = message.find(_EVENT_KEY)
+    if i >= 0:
+        i += len(_EVENT_KEY)
+        j = message.find('"', i)
+        event = message[i:j]
+        if event != "media":
+            return event, None
+        k = message.find(_PAYLOAD_KEY, j)
+        if k >= 0:
+            k += len(_PAYLOAD_KEY)
+            return event, message[k:message.find('"', k)]
+
+    data = json.loads(message)
+    event = data.get("event")
+    if event == "media":
+        return event, data.get("media", {}).get("payload", "")
+    return event, None
+
+
+def decode_payload(payload):
+    return binascii.a2b_base64(payload)
+
+
+class AudioRingBuffer:
+    """Preallocated per-call ring buffer of inbound mu-law audio.
+
+    Positions are absolute byte offsets since the start of the call, so
+    several readers (overlapping recognition streams) can each keep their
+    own cursor. Only the newest ``capacity`` bytes are retained. If a reader
+    stalls (e.g. the gRPC side stops pulling requests) the writer never
+    blocks; the reader skips ahead and the loss is counted in
+    ``dropped_bytes``.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._end = 0
+        self._waiters = []
+        self.closed = False
+        self.bytes_in = 0
+        self.dropped_bytes = 0
+
+    @property
+    def start(self):
+        return max(0, self._end - self.capacity)
+
+    @property
+    def end(self):
+        return self._end
+
+    def _wake(self, force=False):
+        if not self._waiters:
+            return
+        still_waiting = []
+        for target, waiter in self._waiters:
+            if force or self._end >= target:
+                waiter.set()
+            else:
+                still_waiting.append((target, waiter))
+        self._waiters = still_waiting
+
+    def write(self, data):
+        n = len(data)
+        self.bytes_in += n
+        if n > self.capacity:
+            self._end += n - self.capacity
+            data = data[-self.capacity:]
+            n = self.capacity
+        i = self._end % self.capacity
+        first = min(n, self.capacity - i)
+        self._view[i:i + first] = data[:first]
+        if first < n:
+            self._view[:n - first] = data[first:]
+        self._end += n
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake(force=True)
+
+    def read(self, pos, timeout=None, min_bytes=1):
+        """Return ``(audio, new_pos)`` with everything buffered after ``pos``.
+
+        Blocks until at least ``min_bytes`` are available, the buffer is
+        closed, or ``timeout`` seconds pass; whatever is available is
+        returned in the last two cases. ``timeout=0`` never blocks, which
+        is how the asyncio engine polls the buffer.
+        """
+        start = self.start
+        if pos < start:
+            lost = start - pos
+            self.dropped_bytes += lost
+            logger.warning(f"Inbound audio reader fell behind, dropped {lost} bytes ({self.dropped_bytes} total).")
+            pos = start
+        if self._end - pos < min_bytes and not self.closed and timeout != 0:
+            waiter = Event()
+            entry = (pos + min_bytes, waiter)
+            self._waiters.append(entry)
+            if not waiter.wait(timeout):
+                self._waiters.remove(entry)
+            start = self.start
+            if pos < start:
+                self.dropped_bytes += start - pos
+                pos = start
+
+        end = self._end
+        if end == pos:
+            return b"", pos
+        i = pos % self.capacity
+        j = end % self.capacity
+        if i < j:
+            return bytes(self._view[i:j]), end
+        return bytes(self._view[i:]) + bytes(self._view[:j]), end
@@ -0,0 +1,448 @@
+import json
+import logging
+import os
+import re
+import string
+import time
+from collections import defaultdict, deque
+
+from gevent import monkey
+
+logger = logging.getLogger(__name__)
+
+# The reload watcher is a real OS thread even under gevent, started with the
+# raw primitive and never logging, for the same reasons as recording.py's writer.
+_start_new_thread = monkey.get_original("_thread", "start_new_thread")
+_sleep = monkey.get_original("time", "sleep")
+
+SCHEMA_VERSION = 1
+
+# --- Hebrew normalization ---
+_NIQQUD_AND_CANTILLATION = {cp: None for cp in range(0x0591, 0x05C8)}
+_NIQQUD_AND_CANTILLATION.update({0x05BE: " ", 0x05C0: " ", 0x05C3: " ", 0x05C6: " "})  # maqaf, paseq, sof pasuq
+_STRIP_MARKS = str.maketrans({**_NIQQUD_AND_CANTILLATION, "׳": None, "״": None, "'": None, '"': None})
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+_NON_WORD = re.compile(r"[^\w]+")
+
+PREFIX_LETTERS = "והבלש"  # ו "and", ה "the", ב "in", ל "to", ש "that"
+MAX_PREFIXES = 2
+MIN_STEM = 2
+
+
+def tokenize(text):
+    """Return ``(display, normalized)`` token lists for ``text``.
+
+    ``display`` tokens have niqqud, cantillation and punctuation removed.
+    They are what slots capture and what is spoken back. ``normalized``
+    tokens also map final letters to their regular forms and are
+    lower-cased; they are what gets matched.
+    """
+    cleaned = _NON_WORD.sub(" ", text.translate(_STRIP_MARKS))
+    return cleaned.split(), cleaned.translate(_FINAL_LETTERS).lower().split()
+
+
+def normalize_hebrew(text):
+    return " ".join(tokenize(text)[1])
+
+
+def token_variants(token):
+    """``token`` plus its stems with up to MAX_PREFIXES clitic prefix letters removed.
+
+    Stripping is ambiguous (שלום starts with ש), so every reading is kept and
+    the index decides which one is a known phrase token.
+    """
+    variants = [token]
+    for k in range(1, MAX_PREFIXES + 1):
+        if len(token) - k < MIN_STEM or token[k - 1] not in PREFIX_LETTERS:
+            break
+        variants.append(token[k:])
+    return variants
+
+
+# --- Templates ---
+_SLOT = re.compile(r"^\{(\w+)(\*?)\}$")
+_LITERAL = "literal"
+_SLOT_ONE = "slot"
+_SLOT_MANY = "slot*"
+
+
+def parse_template(phrase):
+    """Split a trigger phrase into ``(kind, value)`` elements.
+
+    ``{name}`` captures one word and ``{name*}`` captures as many words as
+    it can, up to the next literal word or the end of the transcript. Two
+    slots may not be adjacent, and a phrase needs at least one literal word.
+    """
+    if not isinstance(phrase, str):
+        raise ValueError(f"phrase {phrase!r} is not a string")
+    elements = []
+    for word in phrase.split():
+        slot = _SLOT.match(word)
+        if slot:
+            if elements and elements[-1][0] != _LITERAL:
+                raise ValueError(f"adjacent slots in phrase {phrase!r}")
+            elements.append((_SLOT_MANY if slot.group(2) else _SLOT_ONE, slot.group(1)))
+        else:
+            elements.extend((_LITERAL, token) for token in tokenize(word)[1])
+    if not any(kind == _LITERAL for kind, _ in elements):
+        raise ValueError(f"phrase {phrase!r} has no literal words")
+    return elements
+
+
+class Intent:
+    def __init__(self, name, response, priority=0, order=0):
+        self.name = name
+        self.response = response
+        self.priority = priority
+        self.order = order
+        self.slot_names = {field for _, field, _, _ in string.Formatter().parse(response) if field}
+
+    def render(self, slots):
+        return self.response.format_map(slots) if self.slot_names else self.response
+
+
+class _Pattern:
+    """One trigger phrase: its template and the first literal run, which is what the trie indexes."""
+
+    __slots__ = ("intent", "elements", "anchor_start", "anchor")
+
+    def __init__(self, intent, elements):
+        self.intent = intent
+        self.elements = elements
+        self.anchor_start = next(i for i, (kind, _) in enumerate(elements) if kind == _LITERAL)
+        end = self.anchor_start
+        while end < len(elements) and elements[end][0] == _LITERAL:
+            end += 1
+        self.anchor = tuple(value for _, value in elements[self.anchor_start:end])
+
+
+class IntentMatch:
+    def __init__(self, intent, slots, start, end, fuzzy=False, score=1.0):
+        self.intent = intent
+        self.slots = slots
+        self.start = start
+        self.end = end
+        self.fuzzy = fuzzy
+        self.score = score
+
+    @property
+    def response(self):
+        return self.intent.render(self.slots)
+
+    def __repr__(self):
+        return f"IntentMatch({self.intent.name!r}, slots={self.slots}, fuzzy={self.fuzzy}, score={self.score:.2f})"
+
+
+# --- Compiled index ---
+class IntentIndex:
+    """Immutable compiled form of an intents file.
+
+    Trigger phrases go into an Aho-Corasick automaton over normalized
+    words. Each transcript word is fed in with its prefix-stripped
+    variants, so a few automaton states are tracked in parallel. The work
+    per word is bounded by the variant count and ``max_active_states``,
+    not by the number of intents. A hit on a phrase's anchor (its first
+    run of literal words) is then checked against the full template, which
+    captures any slots.
+
+    With ``fuzzy`` enabled, a transcript that matches no phrase is compared
+    with every literal phrase by the Dice coefficient of their character
+    trigram sets. This catches a misrecognized letter or two in an
+    utterance that is only the phrase. Trigrams shared by more than
+    ``max_postings`` phrases carry little signal and are left out of the
+    inverted index, so this lookup is bounded the same way.
+    """
+
+    def __init__(self, data, max_active_states=16, max_postings=256):
+        if not isinstance(data, dict):
+            raise ValueError(f"intents file must hold a JSON object, not {type(data).__name__}")
+        if data.get("schema") != SCHEMA_VERSION:
+            raise ValueError(f"unsupported intents schema {data.get('schema')!r}, expected {SCHEMA_VERSION}")
+        self.version = str(data.get("version", ""))
+        self.fallback = data["fallback"]
+        self.max_active_states = max_active_states
+        self.max_postings = max_postings
+        fuzzy = data.get("fuzzy", {})
+        self.fuzzy_enabled = bool(fuzzy.get("enabled", False))
+        self.fuzzy_threshold = float(fuzzy.get("threshold", 0.8))
+
+        self.intents = []
+        self.patterns = []
+        for order, spec in enumerate(data["intents"]):
+            intent = Intent(spec["name"], spec["response"], int(spec.get("priority", 0)), order)
+            self.intents.append(intent)
+            for phrase in spec["phrases"]:
+                elements = parse_template(phrase)
+                slot_names = {value for kind, value in elements if kind != _LITERAL}
+                missing = intent.slot_names - slot_names
+                if missing:
+                    raise ValueError(f"intent {intent.name!r}: phrase {phrase!r} does not capture {sorted(missing)}")
+                self.patterns.append(_Pattern(intent, elements))
+
+        self._build_automaton()
+        if self.fuzzy_enabled:
+            self._build_ngrams()
+        self._static = frozenset(self.static_responses())
+
+    def _build_automaton(self):
+        goto = [{}]
+        depth = [0]
+        outputs = [[]]
+        for number, pattern in enumerate(self.patterns):
+            state = 0
+            for token in pattern.anchor:
+                nxt = goto[state].get(token)
+                if nxt is None:
+                    nxt = goto[state][token] = len(goto)
+                    goto.append({})
+                    depth.append(depth[state] + 1)
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(number)
+
+        fail = [0] * len(goto)
+        out_link = [-1] * len(goto)  # nearest state on the failure chain that has outputs
+        queue = list(goto[0].values())
+        for state in queue:
+            for token, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and token not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(token, 0) if goto[f].get(token) != nxt else 0
+                out_link[nxt] = fail[nxt] if outputs[fail[nxt]] else out_link[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._depth = depth
+        self._outputs = outputs
+        self._out_link = out_link
+
+    def _step(self, state, token):
+        goto, fail = self._goto, self._fail
+        while state and token not in goto[state]:
+            state = fail[state]
+        return goto[state].get(token, 0)
+
+    @staticmethod
+    def _trigrams(text):
+        padded = f" {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def _build_ngrams(self):
+        postings = defaultdict(list)
+        grams_per_pattern = []
+        for number, pattern in enumerate(self.patterns):
+            if any(kind != _LITERAL for kind, _ in pattern.elements):
+                grams_per_pattern.append(set())  # slot phrases only match exactly
+                continue
+            grams = self._trigrams(" ".join(value for _, value in pattern.elements))
+            grams_per_pattern.append(grams)
+            for gram in grams:
+                postings[gram].append(number)
+        self._postings = {gram: numbers for gram, numbers in postings.items() if len(numbers) <= self.max_postings}
+        self._gram_counts = [sum(1 for gram in grams if gram in self._postings) for grams in grams_per_pattern]
+
+    # --- Matching ---
+    def _verify(self, pattern, anchor_start, variants, display):
+        """Match the whole template around an anchor hit; return ``(slots, start, end)`` or None."""
+        elements = pattern.elements
+        slots = {}
+        start = anchor_start
+        if pattern.anchor_start:  # a single slot before the anchor
+            if anchor_start < 1:
+                return None
+            kind, name = elements[0]
+            start = anchor_start - 1 if kind == _SLOT_ONE else 0
+            slots[name] = " ".join(display[start:anchor_start])
+
+        pos = anchor_start + len(pattern.anchor)
+        i = pattern.anchor_start + len(pattern.anchor)
+        while i < len(elements):
+            kind, value = elements[i]
+            if kind == _LITERAL:
+                if pos >= len(variants) or value not in variants[pos]:
+                    return None
+                pos += 1
+                i += 1
+            elif kind == _SLOT_ONE:
+                if pos >= len(variants):
+                    return None
+                slots[value] = display[pos]
+                pos += 1
+                i += 1
+            else:
+                nxt = elements[i + 1][1] if i + 1 < len(elements) else None
+                stop = len(variants)
+                if nxt is not None:
+                    stop = next((j for j in range(pos + 1, len(variants)) if nxt in variants[j]), None)
+                    if stop is None:
+                        return None
+                if stop <= pos:
+                    return None
+                slots[value] = " ".join(display[pos:stop])
+                pos = stop
+                i += 1
+        return slots, start, pos
+
+    def match_exact(self, variants, display):
+        best = None
+        best_key = None
+        states = {0}
+        depth, outputs, out_link = self._depth, self._outputs, self._out_link
+        for position, word_variants in enumerate(variants):
+            nxt = {self._step(state, token) for state in states for token in word_variants}
+            if len(nxt) > self.max_active_states:
+                nxt = set(sorted(nxt, key=depth.__getitem__, reverse=True)[:self.max_active_states])
+            nxt.add(0)
+            states = nxt
+            for state in states:
+                s = state if outputs[state] else out_link[state]
+                while s > 0:
+                    for number in outputs[s]:
+                        pattern = self.patterns[number]
+                        verified = self._verify(pattern, position + 1 - depth[s], variants, display)
+                        if verified is None:
+                            continue
+                        slots, start, end = verified
+                        intent = pattern.intent
+                        key = (intent.priority, end - start, -intent.order)
+                        if best_key is None or key > best_key:
+                            best, best_key = IntentMatch(intent, slots, start, end), key
+                    s = out_link[s]
+        return best
+
+    def match_fuzzy(self, normalized):
+        if not self.fuzzy_enabled or not normalized:
+            return None
+        counts = defaultdict(int)
+        grams = [gram for gram in self._trigrams(" ".join(normalized)) if gram in self._postings]
+        for gram in grams:
+            for number in self._postings[gram]:
+                counts[number] += 1
+        best = None
+        best_key = None
+        for number, shared in counts.items():
+            score = 2 * shared / (self._gram_counts[number] + len(grams))
+            if score < self.fuzzy_threshold:
+                continue
+            intent = self.patterns[number].intent
+            key = (score, intent.priority, -intent.order)
+            if best_key is None or key > best_key:
+                best, best_key = IntentMatch(intent, {}, 0, len(normalized), fuzzy=True, score=score), key
+        return best
+
+    def match(self, text):
+        display, normalized = tokenize(text)
+        variants = [token_variants(token) for token in normalized]
+        return self.match_exact(variants, display) or self.match_fuzzy(normalized)
+
+    def static_responses(self):
+        """Responses without slots, i.e. every sentence that can be rendered ahead of time."""
+        responses = [intent.response for intent in self.intents if not intent.slot_names]
+        return tuple(dict.fromkeys(responses + [self.fallback]))
+
+    def is_static_response(self, text):
+        """True if ``text`` is one of the fixed responses, False for a reply rendered with slot values."""
+        return text in self._static
+
+
+# --- Hot-reloading engine ---
+class IntentEngine:
+    """Serves matches from an intents file and picks up edits without a restart.
+
+    Every ``reload_interval`` seconds a watcher thread checks the file's
+    mtime and size. If they changed, it compiles the file into a new
+    IntentIndex off the event loop (a large file takes a second or more)
+    and queues it. The next ``match()`` swaps it in with one reference
+    assignment, so a match that is already running keeps the index it
+    started with. A file that fails to parse or validate is logged and the
+    previous index stays in service. Writers should replace the file
+    atomically (write elsewhere, then rename) so a half-written file is
+    never read. Callables appended to ``on_reload`` are called, from
+    ``match()``, with each newly swapped-in index.
+
+    The watcher starts on the first match, so an engine made before a fork
+    is safe to use in each worker. ``reload()`` checks and swaps inline.
+    """
+
+    def __init__(self, path, reload_interval=2.0, **index_options):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index_options = index_options
+        self._signature = None
+        self._watching = False
+        # deque append/popleft are atomic, so the watcher and the media path share it without locks
+        self._loaded = deque()
+        self.index = None
+        self.on_reload = []
+        if not self.reload():
+            raise ValueError(f"could not load intents from {path}")
+
+    def _file_signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _check(self):
+        """Compile the file if it changed, without logging (it runs on the watcher).
+
+        Returns None if the file is unchanged, else ``(index, seconds, error)``
+        with either ``index`` or the ``error`` message set.
+        """
+        try:
+            signature = self._file_signature()
+        except OSError as e:
+            return None, 0.0, f"Failed to stat intents file {self.path}: {e}"
+        if signature == self._signature:
+            return None
+        self._signature = signature  # a bad file is reported once, not on every check
+        started = time.perf_counter()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            index = IntentIndex(data, **self.index_options)
+        except Exception as e:  # any malformed file, e.g. a phrase that is not a string
+            return None, 0.0, f"Failed to load intents from {self.path}: {e!r}"
+        return index, time.perf_counter() - started, None
+
+    def _swap(self, index, seconds, error):
+        if error is not None:
+            logger.error(error)
+            return
+        self.index = index
+        logger.info(
+            f"Loaded intents version {index.version!r}: {len(index.intents)} intents, "
+            f"{len(index.patterns)} phrases in {seconds * 1000:.1f} ms."
+        )
+        for callback in self.on_reload:
+            try:
+                callback(index)
+            except Exception as e:
+                logger.error(f"Intents reload callback failed: {e}", exc_info=True)
+
+    def reload(self):
+        """Compile the file now if it changed; return True if an index is in service."""
+        loaded = self._check()
+        if loaded is not None:
+            self._swap(*loaded)
+        return self.index is not None
+
+    def _watch(self):
+        while True:
+            _sleep(self.reload_interval)
+            loaded = self._check()
+            if loaded is not None:
+                self._loaded.append(loaded)
+
+    def match(self, text):
+        if self.reload_interval is not None:
+            if not self._watching:
+                self._watching = True
+                _start_new_thread(self._watch, ())
+            while self._loaded:
+                self._swap(*self._loaded.popleft())
+        return self.index.match(text)
+
+    def respond(self, text):
+        match = self.match(text)
+        return match.response if match is not None else self.index.fallback
@@ -0,0 +1,179 @@
+import base64
+import json
+import logging
+import time
+
+import gevent
+from gevent.queue import JoinableQueue, Empty
+
+from audio_codec import FRAME_BYTES, MULAW_SILENCE
+
+logger = logging.getLogger(__name__)
+
+FRAME_SECONDS = 0.02
+
+
+def take_frames(partial, pad=False):
+    """Remove and return the whole 20 ms frames at the front of ``partial`` (a bytearray).
+
+    What is left is the start of the next frame. With ``pad`` (end of a
+    response) it is padded with silence and returned as a last frame.
+    Shared by both engines' schedulers.
+    """
+    if pad and len(partial) % FRAME_BYTES:
+        partial += bytes([MULAW_SILENCE]) * (FRAME_BYTES - len(partial) % FRAME_BYTES)
+    usable = len(partial) - len(partial) % FRAME_BYTES
+    frames = [bytes(partial[offset:offset + FRAME_BYTES]) for offset in range(0, usable, FRAME_BYTES)]
+    del partial[:usable]
+    return frames
+
+
+class OutboundScheduler:
+    """Per-call greenlet that paces outbound audio to Twilio in real time.
+
+    Audio handed to ``send_audio()`` is cut into 160-byte / 20 ms mu-law
+    frames and queued; the scheduler greenlet sends one frame per 20 ms of
+    monotonic time, never more than ``lead_ms`` ahead of the playout point.
+    The queue is bounded, so a producer that runs ahead of real time blocks
+    instead of growing memory. ``mark()`` is queued in order with the audio,
+    so Twilio acknowledges it when playback reaches that point.
+    ``barge_in()`` drops everything not yet sent and tells Twilio to
+    ``clear`` what it has buffered. ``when_reached()`` queues a callback in
+    the same order, which is how per-call tracing times the first frame of
+    each response. ``tap(frame)``, if given, is called with every frame
+    after it is sent (the call recorder's outbound channel).
+    """
+
+    def __init__(self, ws, stream_sid, lead_ms=60, max_queued_frames=250, tap=None):
+        self.ws = ws
+        self.stream_sid = stream_sid
+        self.tap = tap
+        self.lead = lead_ms / 1000.0
+        self._queue = JoinableQueue(maxsize=max_queued_frames)
+        self._partial = bytearray()
+        self._epoch = 0
+        self._next_due = None
+        self._greenlet = None
+        self.pending_marks = set()
+        self.frames_sent = 0
+        self.clears_sent = 0
+        self.last_frame_at = None
+
+    # --- Producer side ---
+    def start(self):
+        self._greenlet = gevent.spawn(self._run)
+        return self
+
+    def send_audio(self, mulaw):
+        self._partial += mulaw
+        self._queue_frames(take_frames(self._partial))
+
+    def end_audio(self):
+        """Pad and queue the trailing partial frame of a response."""
+        self._queue_frames(take_frames(self._partial, pad=True))
+
+    def _queue_frames(self, frames):
+        epoch = self._epoch
+        for frame in frames:
+            if epoch != self._epoch:
+                # Barged in while we were blocked on a full queue.
+                return
+            self._queue.put((epoch, frame))
+
+    def mark(self, name):
+        self._queue.put((self._epoch, name))
+
+    def when_reached(self, callback):
+        """Call ``callback()`` just before the next queued frame goes out (skipped on barge-in)."""
+        self._queue.put((self._epoch, callback))
+
+    def barge_in(self):
+        """Drop queued audio and ask Twilio to discard its buffered audio."""
+        dropped = self._drop_queued()
+        # Twilio echoes outstanding marks back once the buffer is cleared.
+        self.pending_marks.clear()
+        self._send({"event": "clear", "streamSid": self.stream_sid})
+        self.clears_sent += 1
+        logger.debug(f"Barge-in: dropped {dropped} queued items and sent 'clear' to Twilio.")
+
+    def on_mark(self, name):
+        """Record Twilio's acknowledgement of a mark we sent."""
+        self.pending_marks.discard(name)
+
+    @property
+    def epoch(self):
+        """Incremented by every barge_in(); lets producers notice they were interrupted."""
+        return self._epoch
+
+    @property
+    def is_playing(self):
+        return self._queue.unfinished_tasks > 0 or bool(self.pending_marks)
+
+    def wait_until_drained(self, timeout=None):
+        return self._queue.join(timeout=timeout)
+
+    def stop(self):
+        """Discard whatever is still queued and stop sending; the call is over."""
+        if self._greenlet is None:
+            return
+        self._drop_queued()
+        self._greenlet.kill(timeout=1)
+        self._greenlet = None
+
+    # --- Scheduler greenlet ---
+    def _drop_queued(self):
+        """Invalidate everything queued (including a frame waiting for its slot) and empty the queue."""
+        self._epoch += 1
+        self._partial.clear()
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+            self._queue.task_done()
+            dropped += 1
+        self._next_due = None
+        return dropped
+
+    def _send(self, message):
+        try:
+            self.ws.send(json.dumps(message))
+        except Exception as e:
+            logger.error(f"Failed to send '{message.get('event')}' to Twilio: {e}")
+
+    def _run(self):
+        while True:
+            epoch, payload = self._queue.get()
+            try:
+                if epoch != self._epoch:
+                    continue
+                if isinstance(payload, str):
+                    self._send({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": payload}})
+                    self.pending_marks.add(payload)
+                    continue
+                if callable(payload):
+                    payload()
+                    continue
+
+                now = time.monotonic()
+                if self._next_due is None or self._next_due < now:
+                    # Idle or underrun: Twilio's buffer is empty, restart the clock.
+                    self._next_due = now
+                wait = self._next_due - self.lead - now
+                if wait > 0:
+                    gevent.sleep(wait)
+                    if epoch != self._epoch:
+                        continue
+                self._send({
+                    "event": "media",
+                    "streamSid": self.stream_sid,
+                    "media": {"payload": base64.b64encode(payload).decode("utf-8")}
+                })
+                self.frames_sent += 1
+                self.last_frame_at = time.monotonic()
+                if self.tap is not None:
+                    self.tap(payload)
+                self._next_due += FRAME_SECONDS
+            finally:
+                self._queue.task_done()
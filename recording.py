@@ -0,0 +1,338 @@
+import collections
+import itertools
+import json
+import logging
+import os
+import struct
+import time
+
+from gevent import monkey
+
+from audio_codec import MULAW_SILENCE
+from ingest import BYTES_PER_SECOND
+from telemetry import RECORDING_BYTES, RECORDINGS, RECORDINGS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# The writer is a real OS thread even when gevent has patched threading, so a
+# slow disk stalls only the writer, never the hub that carries the calls. It is
+# started with the raw primitive: threading.Thread.start() would wait on a
+# patched Event that the new thread cannot set. For the same reason it never
+# calls logging (whose locks are patched too); its errors are queued and logged
+# from the media path by RecordingArchive.report_errors().
+_start_new_thread = monkey.get_original("_thread", "start_new_thread")
+_sleep = monkey.get_original("time", "sleep")
+
+CHANNELS = 2  # left: caller (inbound), right: bot (outbound)
+CALLER, BOT = 0, 1
+WAVE_FORMAT_MULAW = 7
+
+
+def wav_header(frames):
+    """Header of an 8 kHz stereo mu-law WAV file holding ``frames`` sample pairs."""
+    data_bytes = frames * CHANNELS
+    return (
+        b"RIFF" + struct.pack("<I", 50 + data_bytes) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHHH", 18, WAVE_FORMAT_MULAW, CHANNELS, BYTES_PER_SECOND,
+                                BYTES_PER_SECOND * CHANNELS, CHANNELS, 8, 0)
+        + b"fact" + struct.pack("<II", 4, frames)
+        + b"data" + struct.pack("<I", data_bytes)
+    )
+
+
+class CallRecorder:
+    """Audio tap and event log for one call; every method is cheap and never blocks.
+
+    Caller audio is copied, still mu-law, into the left channel of
+    fixed-size interleaved blocks taken from the archive. Bot frames go
+    into the right channel. The caller's byte count is the
+    recording's clock: a bot frame is placed at the caller position when
+    it was sent, or straight after the previous bot frame if that is later.
+    Once the caller audio has moved past a block, the block is handed to
+    the writer thread.
+
+    If the archive refuses a new block, the writer is behind, so this
+    call stops recording. What was already captured is still written out,
+    and the live call never waits.
+    """
+
+    def __init__(self, archive, number):
+        self.archive = archive
+        self.number = number
+        self.started_at = time.time()
+        self.call_sid = None
+        self.stream_sid = None
+        self.recording = True
+        self.dropped = False
+        self.closed = False
+        self._in_pos = 0  # samples per channel
+        self._out_pos = 0
+        self._blocks = {}  # block index -> bytearray, not yet handed to the writer
+        self._sealed_below = 0
+
+    def start(self, call_sid, stream_sid):
+        self.call_sid = call_sid
+        self.stream_sid = stream_sid
+        self.event("start", call_sid=call_sid, stream_sid=stream_sid)
+
+    def inbound(self, audio):
+        if self.archive._errors:
+            self.archive.report_errors()
+        if not self.recording:
+            return
+        self._in_pos = self._write(CALLER, self._in_pos, audio)
+        below = self._in_pos // self.archive.block_samples
+        if below > self._sealed_below:
+            self._seal(below)
+
+    def outbound(self, frame):
+        if self.recording:
+            self._out_pos = self._write(BOT, max(self._out_pos, self._in_pos), frame)
+
+    def event(self, name, **fields):
+        """Add a line to the JSONL sidecar, stamped with the position in the recording."""
+        if self.recording:
+            self.archive._submit("event", self, {"t": round(self._in_pos / BYTES_PER_SECOND, 3), "event": name, **fields})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.recording:
+            self.recording = False
+            self._seal(None)
+        self.archive._submit("close", self, max(self._in_pos, self._out_pos))
+        self.archive._live_calls -= 1
+        self.archive.report_errors()
+
+    def _write(self, channel, pos, data):
+        view = memoryview(data)
+        samples = self.archive.block_samples
+        while view:
+            index, offset = divmod(pos, samples)
+            block = self._blocks.get(index)
+            if block is None:
+                block = self._blocks[index] = self.archive._acquire()
+                if block is None:
+                    del self._blocks[index]
+                    self._drop()
+                    return pos
+            n = min(len(view), samples - offset)
+            block[CHANNELS * offset + channel:CHANNELS * (offset + n):CHANNELS] = view[:n]
+            view = view[n:]
+            pos += n
+        return pos
+
+    def _seal(self, below):
+        """Hand every open block before index ``below`` (all of them for None) to the writer."""
+        for index in sorted(self._blocks):
+            if below is not None and index >= below:
+                break
+            self.archive._submit("audio", self, (index, self._blocks.pop(index)))
+        if below is not None:
+            self._sealed_below = below
+
+    def _drop(self):
+        self.recording = False
+        self.dropped = True
+        RECORDINGS_DROPPED.inc()
+        logger.warning(f"Recording buffer full, dropping the rest of the recording for call {self.call_sid}.")
+        self._seal(None)
+        self.archive._submit("event", self, {"t": round(self._in_pos / BYTES_PER_SECOND, 3), "event": "recording_dropped"})
+
+
+class _CallFiles:
+    """The WAV and JSONL files of one recording; only touched by the writer thread."""
+
+    def __init__(self, directory, recorder):
+        started = time.gmtime(recorder.started_at)
+        name = recorder.call_sid or f"call-{recorder.number}"
+        day = os.path.join(directory, time.strftime("%Y-%m-%d", started))
+        os.makedirs(day, exist_ok=True)
+        base = os.path.join(day, f"{time.strftime('%H%M%S', started)}-{name}")
+        self.wav_path = base + ".wav"
+        self.wav = open(self.wav_path, "wb")
+        self.wav.write(wav_header(0))
+        self.sidecar = open(base + ".jsonl", "w", encoding="utf-8")
+        self.frames = 0
+        self.failed = False
+        self.synced = time.monotonic()
+        self.write_event({
+            "event": "call", "call_sid": recorder.call_sid, "stream_sid": recorder.stream_sid,
+            "started_at": round(recorder.started_at, 3), "audio": os.path.basename(self.wav_path),
+            "encoding": "mulaw", "sample_rate": BYTES_PER_SECOND, "channels": ["caller", "bot"],
+        })
+
+    def write_block(self, index, block, block_samples, silence):
+        # A gap (e.g. no caller audio for a while) is filled with silence so positions stay aligned.
+        while self.frames < index * block_samples:
+            self.wav.write(silence)
+            self.frames += block_samples
+        if self.frames == index * block_samples:
+            self.wav.write(block)
+            self.frames += block_samples
+            RECORDING_BYTES.inc(len(block))
+
+    def write_event(self, record):
+        self.sidecar.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def sync(self):
+        """Make the header match the data written so far, then fsync both files."""
+        self.wav.seek(0)
+        self.wav.write(wav_header(self.frames))
+        self.wav.seek(0, os.SEEK_END)
+        for f in (self.wav, self.sidecar):
+            f.flush()
+            os.fsync(f.fileno())
+        self.synced = time.monotonic()
+
+    def close(self, samples):
+        try:
+            if samples < self.frames:
+                # Whole blocks were written; cut the trailing silence past the end of the call.
+                self.frames = samples
+                self.wav.truncate(len(wav_header(0)) + samples * CHANNELS)
+            if not self.failed:
+                self.sync()
+        finally:
+            self.wav.close()
+            self.sidecar.close()
+
+
+class RecordingArchive:
+    """Per-call stereo WAV recordings with a JSONL sidecar, written in the background.
+
+    Audio travels in blocks of ``block_ms`` of stereo audio. Each recorder
+    fills its own working blocks and queues them once the call has moved
+    past them. A single writer thread wakes every ``poll_ms``, writes
+    whatever is queued, returns the blocks for reuse and fsyncs each open
+    file at most every ``fsync_seconds``. Only the queue is capped, at
+    ``buffer_seconds`` of audio per live call, i.e. the disk may fall that
+    far behind. Beyond it new blocks cannot be had and the calls that need
+    one stop recording (see CallRecorder). The blocks live calls are still
+    filling do not count, so a busy box does not lose recordings to an
+    idle disk.
+
+    Files go to ``<directory>/<UTC date>/<UTC time>-<CallSid>.wav`` and
+    ``.jsonl``. The writer thread starts on the first recorded call, so an
+    archive made before a fork is safe to use in each worker.
+    """
+
+    def __init__(self, directory, buffer_seconds=30, block_ms=500, fsync_seconds=5.0, poll_ms=200):
+        self.directory = directory
+        self.block_samples = block_ms * BYTES_PER_SECOND // 1000
+        self.fsync_seconds = fsync_seconds
+        self.poll_seconds = poll_ms / 1000.0
+        self._silence = bytes([MULAW_SILENCE]) * (self.block_samples * CHANNELS)
+        self.max_blocks = max(2, buffer_seconds * 1000 // block_ms)
+        # deque append/popleft are atomic, so the media path and the writer share these without locks
+        self._free = collections.deque()  # written blocks, reset to silence, for reuse
+        self._pending = collections.deque()
+        # Blocks waiting for the disk: each counter has a single writer, so no lock is needed
+        self._blocks_queued = 0  # media path
+        self._blocks_written = 0  # writer thread
+        self._live_calls = 0
+        self._errors = collections.deque()  # messages from the writer thread, logged by report_errors()
+        self._numbers = itertools.count(1)
+        self._started = False
+        self._stopping = False
+        self._finished = False
+
+    def open_call(self):
+        if not self._started:
+            self._started = True
+            _start_new_thread(self._run, ())
+        self.report_errors()
+        self._live_calls += 1
+        RECORDINGS.inc()
+        return CallRecorder(self, next(self._numbers))
+
+    def close(self, timeout=10):
+        """Write out everything queued and close all files."""
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        while self._started and not self._finished and time.monotonic() < deadline:
+            time.sleep(self.poll_seconds / 2)
+        self.report_errors()
+
+    def report_errors(self):
+        """Log what the writer thread queued; call from the media path (greenlet or event loop)."""
+        while self._errors:
+            logger.error(self._errors.popleft())
+
+    def _acquire(self):
+        """A silent block for a recorder to fill, or None if the writer is ``buffer_seconds`` behind."""
+        if self._blocks_queued - self._blocks_written >= self.max_blocks * max(1, self._live_calls):
+            return None
+        try:
+            return self._free.popleft()
+        except IndexError:
+            return bytearray(self._silence)
+
+    def _submit(self, kind, recorder, payload):
+        if kind == "audio":
+            self._blocks_queued += 1
+        self._pending.append((kind, recorder, payload))
+
+    # --- Writer thread ---
+    def _run(self):
+        try:
+            self._write_until_stopped()
+        finally:
+            self._finished = True
+
+    def _write_until_stopped(self):
+        files = {}
+        while True:
+            stopping = self._stopping
+            while self._pending:
+                kind, recorder, payload = self._pending.popleft()
+                self._handle(files, kind, recorder, payload)
+            now = time.monotonic()
+            for recorder, call_files in files.items():
+                if not call_files.failed and now - call_files.synced >= self.fsync_seconds:
+                    self._guard(recorder, call_files, call_files.sync)
+            if stopping:
+                for recorder, call_files in files.items():
+                    self._guard(recorder, call_files, call_files.close, max(recorder._in_pos, recorder._out_pos))
+                return
+            _sleep(self.poll_seconds)
+
+    def _handle(self, files, kind, recorder, payload):
+        call_files = files.get(recorder)
+        try:
+            if call_files is None:
+                if kind == "close":
+                    return
+                try:
+                    call_files = files[recorder] = _CallFiles(self.directory, recorder)
+                except OSError as e:
+                    self._errors.append(f"Could not create recording for call {recorder.call_sid}: {e}")
+                    recorder.recording = False
+                    return
+            if kind == "audio":
+                index, block = payload
+                if not call_files.failed:
+                    self._guard(recorder, call_files, call_files.write_block, index, block, self.block_samples, self._silence)
+            elif kind == "event":
+                if not call_files.failed:
+                    self._guard(recorder, call_files, call_files.write_event, payload)
+            elif kind == "close":
+                del files[recorder]
+                self._guard(recorder, call_files, call_files.close, payload)
+        finally:
+            if kind == "audio":
+                block = payload[1]
+                if len(self._free) < self.max_blocks:
+                    block[:] = self._silence
+                    self._free.append(block)
+                self._blocks_written += 1
+
+    def _guard(self, recorder, call_files, method, *args):
+        try:
+            method(*args)
+        except (OSError, ValueError) as e:
+            if not call_files.failed:
+                self._errors.append(f"Recording for call {recorder.call_sid} failed, discarding the rest: {e}")
+            call_files.failed = True
+            recorder.recording = False
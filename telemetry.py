@@ -0,0 +1,237 @@
+import bisect
+import hmac
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+# Stage spans observed into voicebot_stage_seconds, keyed by the stage that closes them.
+# Turn stages live in a per-turn dict; call stages in the trace's own dict. "speech_end"
+# is when the local VAD declares the end of the utterance, i.e. after its hangover.
+TURN_SPANS = {
+    "final_transcript": (("speech_end", "stt_finalize"),),
+    "bot_decision": (("final_transcript", "bot_decision"),),
+    "tts_first_byte": (("tts_request", "tts_first_byte"),),
+    "first_outbound_frame": (("final_transcript", "response"), ("speech_end", "end_of_speech_to_audio")),
+}
+CALL_SPANS = {
+    "first_inbound_frame": (("ws_accept", "call_setup"),),
+}
+
+
+# --- Prometheus metrics (text exposition format, no client library) ---
+_REGISTRY = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        _REGISTRY.append(self)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, (), self.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """Fixed-bucket histogram with one optional label (e.g. the pipeline stage)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+        _REGISTRY.append(self)
+
+    def observe(self, value, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_value, series in sorted(self._series.items(), key=lambda item: str(item[0])):
+            base = ((self.label, label_value),) if self.label else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", base + (("le", le),), cumulative
+            yield f"{self.name}_count", base, cumulative
+            yield f"{self.name}_sum", base, series[-1]
+
+
+def render_metrics():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def make_metrics_app(token=None):
+    """WSGI app serving ``render_metrics()`` at /metrics, optionally behind a bearer token.
+
+    It is meant for its own internal listener, never for the public app that
+    carries the Twilio webhooks: call volume and latency are not public data.
+    """
+    expected = f"Bearer {token}".encode() if token else None
+
+    def metrics_app(environ, start_response):
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+        if expected is not None and not hmac.compare_digest(environ.get("HTTP_AUTHORIZATION", "").encode(), expected):
+            start_response("401 Unauthorized", [("Content-Type", "text/plain"), ("WWW-Authenticate", "Bearer")])
+            return [b"Unauthorized\n"]
+        body = render_metrics().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                                  ("Content-Length", str(len(body)))])
+        return [body]
+
+    return metrics_app
+
+
+CALLS = Counter("voicebot_calls_total", "Media stream WebSockets accepted.")
+ACTIVE_CALLS = Gauge("voicebot_active_calls", "Calls currently in progress.")
+TURNS = Counter("voicebot_turns_total", "Bot responses started.")
+FRAMES_IN = Counter("voicebot_frames_in_total", "Inbound media frames received (counted when each call ends).")
+FRAMES_OUT = Counter("voicebot_frames_out_total", "Outbound 20 ms media frames sent (counted when each call ends).")
+DECODE_ERRORS = Counter("voicebot_decode_errors_total", "Inbound media payloads that failed to decode.")
+DROPPED_BYTES = Counter("voicebot_inbound_dropped_bytes_total", "Inbound audio lost because a reader fell behind.")
+BARGE_INS = Counter("voicebot_barge_ins_total", "Bot responses cut off by the caller.")
+RECOGNITION_STREAMS = Counter("voicebot_recognition_streams_total", "Google streaming_recognize calls opened.")
+WARM_PATH_HITS = Counter("voicebot_warm_path_hits_total", "Media streams that found resources prepared at /voice.")
+WARM_PATH_MISSES = Counter("voicebot_warm_path_misses_total", "Media streams that had no prepared resources to pick up.")
+RECORDINGS = Counter("voicebot_recordings_total", "Calls whose audio and transcript are being archived.")
+RECORDINGS_DROPPED = Counter("voicebot_recordings_dropped_total", "Recordings cut short because the writer fell behind.")
+RECORDING_BYTES = Counter("voicebot_recording_bytes_total", "Recorded audio bytes written to disk.")
+TRANSCODE_SECONDS = Counter("voicebot_transcode_seconds_total", "Time spent transcoding TTS audio to mu-law.")
+STAGE_SECONDS = Histogram("voicebot_stage_seconds", "Latency between pipeline stages of a call.", label="span")
+CALL_SECONDS = Histogram("voicebot_call_seconds", "Call duration.", buckets=(10, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+# --- Per-call traces ---
+class TraceWriter:
+    """Appends one JSON line per finished call to ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def write(self, record):
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not write call trace to {self.path}: {e}")
+
+
+class CallTrace:
+    """Monotonic stage timestamps for one call.
+
+    ``mark()`` records the first time a stage is reached. Times are seconds
+    since the WebSocket was accepted. Stages of a single bot turn (speech
+    end, final transcript, bot decision, TTS request and first byte, first
+    outbound frame) go into a per-turn dict from ``begin_turn()``. Marking
+    a stage that closes a span observes it into ``voicebot_stage_seconds``.
+    Everything is aggregated into the global counters by ``finish()``.
+
+    ``log_sampled`` is decided once per call. Hot-path DEBUG logs are only
+    emitted for sampled calls, so turning on DEBUG logging in production
+    does not log every turn of every call.
+    """
+
+    def __init__(self, log_sample_rate=1.0, writer=None):
+        self.started = time.monotonic()
+        self.wall_started = time.time()
+        self.log_sampled = random.random() < log_sample_rate
+        self.writer = writer
+        self.call_sid = None
+        self.stream_sid = None
+        self.stages = {}
+        self.turns = []
+        self.counters = {}
+        self.finished = False
+        self.stages["ws_accept"] = 0.0
+        CALLS.inc()
+        ACTIVE_CALLS.inc()
+
+    def begin_turn(self):
+        turn = {}
+        self.turns.append(turn)
+        return turn
+
+    def mark(self, stage, turn=None, at=None):
+        """Record ``stage`` (once) in ``turn`` or, without one, at call level."""
+        stages = self.stages if turn is None else turn
+        if stage in stages:
+            return
+        now = (time.monotonic() if at is None else at) - self.started
+        stages[stage] = now
+        spans = CALL_SPANS if turn is None else TURN_SPANS
+        for start, name in spans.get(stage, ()):
+            began = stages.get(start)
+            if began is not None:
+                STAGE_SECONDS.observe(now - began, name)
+
+    def finish(self, **counters):
+        """Close the trace with the call's final counters; safe to call twice."""
+        if self.finished:
+            return
+        self.finished = True
+        self.mark("call_end")
+        self.counters = counters
+        ACTIVE_CALLS.dec()
+        CALL_SECONDS.observe(self.stages["call_end"])
+        FRAMES_IN.inc(counters.get("frames_in", 0))
+        FRAMES_OUT.inc(counters.get("frames_out", 0))
+        DECODE_ERRORS.inc(counters.get("decode_errors", 0))
+        DROPPED_BYTES.inc(counters.get("dropped_bytes", 0))
+        BARGE_INS.inc(counters.get("barge_ins", 0))
+        RECOGNITION_STREAMS.inc(counters.get("recognition_streams", 0))
+        TURNS.inc(counters.get("turns", 0))
+        if self.writer is not None:
+            self.writer.write(self.to_record())
+
+    def to_record(self):
+        def ms(stages):
+            return {stage: round(t * 1000, 1) for stage, t in stages.items()}
+
+        return {
+            "call_sid": self.call_sid,
+            "stream_sid": self.stream_sid,
+            "started_at": round(self.wall_started, 3),
+            "stages_ms": ms(self.stages),
+            "turns_ms": [ms(turn) for turn in self.turns if turn],
+            "counters": self.counters,
+        }
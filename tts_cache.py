@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import mmap
+import os
+from collections import OrderedDict
+
+from audio_codec import FRAME_BYTES, MULAW_SILENCE
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 2  # 2: the transcoder is part of the key
+_FILE_SUFFIX = ".ulaw"
+
+
+def cache_key(text, voice_id, model, output_format, codec):
+    raw = "\x1f".join([str(CACHE_FORMAT_VERSION), text, str(voice_id), model, output_format, codec])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def iter_frames(audio, frame_bytes=FRAME_BYTES):
+    """Yield zero-copy 20 ms slices of a frame-aligned mu-law buffer."""
+    view = memoryview(audio)
+    for offset in range(0, len(view), frame_bytes):
+        yield view[offset:offset + frame_bytes]
+
+
+class TTSCache:
+    """Two-level cache of rendered bot prompts.
+
+    Values are 8 kHz mu-law buffers padded to a whole number of 20 ms frames.
+    Level one is a bounded in-memory LRU; level two is one file per prompt in
+    ``cache_dir``, memory-mapped on load so a restart only pays for the pages
+    it actually sends.
+
+    ``codec`` names the transcoder that renders the audio (AUDIO_CODEC) and
+    is part of every key, so switching transcoders never serves audio
+    rendered by the other one.
+
+    ``max_entries=0`` disables both levels. An empty or unusable
+    ``cache_dir`` leaves only the memory level; ``cache_dir`` is then None.
+    """
+
+    def __init__(self, cache_dir, max_entries=256, codec="native"):
+        self.enabled = max_entries > 0
+        self.cache_dir = (cache_dir or None) if self.enabled else None
+        self.max_entries = max_entries
+        self.codec = codec
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if self.cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"TTS cache directory '{cache_dir}' unavailable, using memory only: {e}")
+                self.cache_dir = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + _FILE_SUFFIX)
+
+    def _remember(self, key, audio):
+        self._entries[key] = audio
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: empty file, cannot be mapped.
+            return None
+        except OSError as e:
+            logger.warning(f"Could not map TTS cache file for key {key}: {e}")
+            return None
+
+    def get(self, text, voice_id, model, output_format):
+        key = cache_key(text, voice_id, model, output_format, self.codec)
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return audio
+        audio = self._load(key)
+        if audio is not None:
+            self._remember(key, audio)
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            return audio
+        self.stats["misses"] += 1
+        return None
+
+    def contains(self, text, voice_id, model, output_format):
+        key = cache_key(text, voice_id, model, output_format, self.codec)
+        return key in self._entries or (self.cache_dir is not None and os.path.exists(self._path(key)))
+
+    def put(self, text, voice_id, model, output_format, audio):
+        if not audio or not self.enabled:
+            return
+        remainder = len(audio) % FRAME_BYTES
+        if remainder:
+            audio = bytes(audio) + bytes([MULAW_SILENCE]) * (FRAME_BYTES - remainder)
+        else:
+            audio = bytes(audio)
+
+        key = cache_key(text, voice_id, model, output_format, self.codec)
+        self._remember(key, audio)
+        self.stats["stores"] += 1
+
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache file '{path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,161 @@
+import collections
+import os
+
+import numpy as np
+
+from audio_codec import FRAME_BYTES, ULAW_DECODE_TABLE
+
+SPEECH_START = "speech_start"
+SPEECH_END = "speech_end"
+
+_FULL_SCALE_DB = 20 * np.log10(32768.0)
+_FRAME_MS = 20
+_NOISE_SUBWINDOWS = 4
+
+
+class VADConfig:
+    """Tunable VAD parameters; ``from_env()`` reads ``VAD_<NAME>`` overrides."""
+
+    def __init__(self, margin_db=12.0, min_energy_db=-50.0, max_zcr=0.45, loud_db=10.0,
+                 start_ms=60, hangover_ms=600, preroll_ms=200, tail_ms=200,
+                 noise_adapt=0.05, initial_noise_db=-60.0, noise_window_ms=3000, noise_rise=0.01):
+        self.margin_db = margin_db                # speech must be this far above the noise floor...
+        self.min_energy_db = min_energy_db        # ...and above this absolute level (dBFS)
+        self.max_zcr = max_zcr                    # higher zero-crossing rates count as noise...
+        self.loud_db = loud_db                    # ...unless this far above the threshold (fricatives)
+        self.start_ms = start_ms                  # voiced audio needed to declare speech start
+        self.hangover_ms = hangover_ms            # silence needed to declare end of utterance
+        self.preroll_ms = preroll_ms              # audio kept before the detected start
+        self.tail_ms = tail_ms                    # audio kept after the last voiced frame
+        self.noise_adapt = noise_adapt            # noise floor smoothing factor per silent frame
+        self.initial_noise_db = initial_noise_db
+        self.noise_window_ms = noise_window_ms    # minimum-statistics window for the noise floor...
+        self.noise_rise = noise_rise              # ...which it climbs towards at this rate per frame
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        config = cls()
+        for name, default in vars(config).items():
+            value = environ.get(f"VAD_{name.upper()}")
+            if value is not None:
+                setattr(config, name, type(default)(value))
+        return config
+
+    def __repr__(self):
+        return f"VADConfig({', '.join(f'{k}={v}' for k, v in vars(self).items())})"
+
+
+def frame_features(audio):
+    """Energy (dBFS) and zero-crossing rate for each whole 20 ms frame of mu-law audio."""
+    codes = np.frombuffer(audio, dtype=np.uint8)
+    frames = ULAW_DECODE_TABLE[codes[:len(codes) - len(codes) % FRAME_BYTES]].reshape(-1, FRAME_BYTES)
+    samples = frames.astype(np.float32)
+    energy_db = 10 * np.log10(np.mean(samples * samples, axis=1) + 1.0) - _FULL_SCALE_DB
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (FRAME_BYTES - 1)
+    return energy_db, zcr
+
+
+class VoiceActivityDetector:
+    """Streaming energy / zero-crossing VAD over 8 kHz mu-law.
+
+    Feed it every inbound byte in order. ``process()`` returns a list of
+    ``(event, position)`` tuples. ``event`` is SPEECH_START or SPEECH_END.
+    ``position`` is an absolute byte offset in the same stream, so it can be
+    used directly as a cursor into the inbound ring buffer. A start position
+    already includes the preroll. An end position includes the tail after
+    the last voiced frame.
+
+    The noise floor follows silent frames closely. It also rises, on every
+    frame, towards the quietest frame of the last ``noise_window_ms``
+    (minimum statistics). Speech always has dips within such a window, but
+    steady background noise (hum, fans, line noise) does not. Without this,
+    noise loud enough to count as voiced would never be learned and would
+    hold the detector in speech for the rest of the call.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or VADConfig()
+        self.start_frames = max(1, self.config.start_ms // _FRAME_MS)
+        self.hangover_frames = max(1, self.config.hangover_ms // _FRAME_MS)
+        self.preroll_frames = self.config.preroll_ms // _FRAME_MS
+        self.tail_frames = self.config.tail_ms // _FRAME_MS
+        self.noise_db = self.config.initial_noise_db
+        self._noise_sub_frames = max(1, self.config.noise_window_ms // _FRAME_MS // _NOISE_SUBWINDOWS)
+        self._noise_minima = collections.deque(maxlen=_NOISE_SUBWINDOWS - 1)  # minima of finished sub-windows
+        self._sub_min = float("inf")
+        self._sub_frames = 0
+        self.in_speech = False
+        self.frames_seen = 0
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._last_voiced = 0
+        self._remainder = b""
+
+    @property
+    def forward_pos(self):
+        """Byte offset up to which audio is worth sending to the recognizer.
+
+        While the hangover timer runs after the last voiced frame, anything
+        beyond the tail is held back; it is released if speech resumes and
+        dropped if the utterance ends.
+        """
+        if self.in_speech and self._silent_run > self.tail_frames:
+            return (self._last_voiced + 1 + self.tail_frames) * FRAME_BYTES
+        return self.frames_seen * FRAME_BYTES
+
+    def _is_voiced(self, energy_db, zcr):
+        threshold = max(self.noise_db + self.config.margin_db, self.config.min_energy_db)
+        if energy_db < threshold:
+            return False
+        return zcr <= self.config.max_zcr or energy_db >= threshold + self.config.loud_db
+
+    def _track_noise_floor(self, energy_db, voiced):
+        self._sub_min = min(self._sub_min, energy_db)
+        self._sub_frames += 1
+        floor = min(self._sub_min, min(self._noise_minima, default=self._sub_min))
+        if self._sub_frames == self._noise_sub_frames:
+            self._noise_minima.append(self._sub_min)
+            self._sub_min = float("inf")
+            self._sub_frames = 0
+        if not voiced:
+            self.noise_db += self.config.noise_adapt * (energy_db - self.noise_db)
+        elif floor > self.noise_db:
+            self.noise_db += self.config.noise_rise * (floor - self.noise_db)
+
+    def process(self, audio, decisions=None):
+        """Consume mu-law bytes; optionally append the per-frame in-speech state to ``decisions``."""
+        if self._remainder:
+            audio = self._remainder + audio
+        usable = len(audio) - len(audio) % FRAME_BYTES
+        self._remainder = bytes(audio[usable:])
+        if not usable:
+            return []
+
+        events = []
+        energies, zcrs = frame_features(audio[:usable])
+        for energy_db, zcr in zip(energies.tolist(), zcrs.tolist()):
+            frame = self.frames_seen
+            self.frames_seen += 1
+            voiced = self._is_voiced(energy_db, zcr)
+            if voiced:
+                self._voiced_run += 1
+                self._silent_run = 0
+                self._last_voiced = frame
+            else:
+                self._voiced_run = 0
+                self._silent_run += 1
+            self._track_noise_floor(energy_db, voiced)
+
+            if not self.in_speech and self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                start = max(0, frame + 1 - self.start_frames - self.preroll_frames)
+                events.append((SPEECH_START, start * FRAME_BYTES))
+            elif self.in_speech and self._silent_run >= self.hangover_frames:
+                self.in_speech = False
+                end = min(self.frames_seen, self._last_voiced + 1 + self.tail_frames)
+                events.append((SPEECH_END, end * FRAME_BYTES))
+
+            if decisions is not None:
+                decisions.append(self.in_speech)
+        return events
@@ -0,0 +1,203 @@
+import json
+import logging
+import time
+
+import gevent
+import grpc
+import httpx
+from elevenlabs.client import ElevenLabs
+from google.cloud import speech
+from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+from google.oauth2 import service_account
+
+from telemetry import WARM_PATH_HITS, WARM_PATH_MISSES
+
+logger = logging.getLogger(__name__)
+
+SPEECH_HOST = "speech.googleapis.com:443"
+# Ping idle connections so NATs and load balancers keep them open between calls.
+KEEPALIVE_OPTIONS = (
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+)
+
+
+def load_gcp_credentials(credentials_json):
+    """Service-account credentials parsed in memory; nothing is written to disk."""
+    if not credentials_json:
+        logger.critical("GCP_CREDENTIALS_JSON environment variable is not set. Cannot proceed with GCP authentication.")
+        return None
+    try:
+        return service_account.Credentials.from_service_account_info(json.loads(credentials_json))
+    except json.JSONDecodeError as e:
+        logger.critical(f"Error decoding GCP_CREDENTIALS_JSON: {e}. Check its content for valid JSON.", exc_info=True)
+    except Exception as e:
+        logger.critical(f"Critical error during GCP credentials loading: {e}", exc_info=True)
+    return None
+
+
+class PreparedCall:
+    """Resources opened for one CallSid between /voice and the media stream's 'start'."""
+
+    def __init__(self, call_sid, speech_client, streaming_config):
+        self.call_sid = call_sid
+        self.speech_client = speech_client
+        self.streaming_config = streaming_config
+        self.created = time.monotonic()
+
+
+class WarmPathManager:
+    """Long-lived Speech and ElevenLabs connections, plus per-call warm-up.
+
+    Nothing is created at import time. The Speech clients, a small pool of
+    keepalive gRPC channels used round-robin, and the pooled HTTP session
+    for ElevenLabs are all built on first use. ``warm_up()`` can do that in
+    the background when the server starts.
+
+    ``prepare(call_sid)`` runs when /voice returns TwiML. While Twilio is
+    still connecting the media stream, it picks a channel, makes sure the
+    channel is connected, and opens (or reuses) an idle TTS connection. The
+    session then ``claim()``s those resources on the 'start' event.
+    Unclaimed calls expire after ``prepared_ttl`` seconds.
+    """
+
+    def __init__(self, make_streaming_config, gcp_credentials_json=None, speech_emulator_host=None,
+                 elevenlabs_api_key=None, elevenlabs_api_base="https://api.elevenlabs.io",
+                 speech_channels=4, tts_connections=64, prepared_ttl=30, connect_timeout=5):
+        self.make_streaming_config = make_streaming_config
+        self.gcp_credentials_json = gcp_credentials_json
+        self.speech_emulator_host = speech_emulator_host
+        self.elevenlabs_api_key = elevenlabs_api_key
+        self.elevenlabs_api_base = elevenlabs_api_base
+        self.speech_channels = max(1, speech_channels)
+        self.tts_connections = tts_connections
+        self.prepared_ttl = prepared_ttl
+        self.connect_timeout = connect_timeout
+        self._speech_clients = None
+        self._channels = []
+        self._next_client = 0
+        self._http = None
+        self._elevenlabs = None
+        self._tts_initialized = False
+        self._prepared = {}
+
+    # --- Shared clients (lazy) ---
+    def _open_channel(self, credentials):
+        if self.speech_emulator_host:
+            return grpc.insecure_channel(self.speech_emulator_host, options=KEEPALIVE_OPTIONS)
+        return SpeechGrpcTransport.create_channel(SPEECH_HOST, credentials=credentials, options=KEEPALIVE_OPTIONS)
+
+    def _init_speech(self):
+        self._speech_clients = []
+        credentials = None
+        if self.speech_emulator_host:
+            logger.info(f"Google Cloud Speech clients pointed at emulator {self.speech_emulator_host}.")
+        else:
+            credentials = load_gcp_credentials(self.gcp_credentials_json)
+            if credentials is None:
+                logger.critical("Failed to load GCP credentials. Speech-to-Text will not work.")
+                return
+        try:
+            for _ in range(self.speech_channels):
+                channel = self._open_channel(credentials)
+                self._channels.append(channel)
+                self._speech_clients.append(speech.SpeechClient(transport=SpeechGrpcTransport(channel=channel)))
+            logger.info(f"Google Cloud Speech client pool initialized with {self.speech_channels} channels.")
+        except Exception as e:
+            logger.critical(f"Failed to initialize Google Cloud Speech client: {e}", exc_info=True)
+            self._speech_clients = []
+
+    def speech_client(self):
+        """Next pooled Speech client, or None if Speech is not configured."""
+        if self._speech_clients is None:
+            self._init_speech()
+        if not self._speech_clients:
+            return None
+        self._next_client = (self._next_client + 1) % len(self._speech_clients)
+        return self._speech_clients[self._next_client]
+
+    def tts_client(self):
+        """Shared ElevenLabs client on a keepalive connection pool, or None without an API key."""
+        if not self._tts_initialized:
+            self._tts_initialized = True
+            if not self.elevenlabs_api_key:
+                logger.critical("ELEVENLABS_API_KEY environment variable is not set. Text-to-Speech will not work.")
+            else:
+                self._http = httpx.Client(
+                    timeout=httpx.Timeout(60, connect=10),
+                    limits=httpx.Limits(max_keepalive_connections=self.tts_connections, keepalive_expiry=60),
+                )
+                self._elevenlabs = ElevenLabs(
+                    api_key=self.elevenlabs_api_key, base_url=self.elevenlabs_api_base, httpx_client=self._http
+                )
+                logger.info("ElevenLabs client initialized.")
+        return self._elevenlabs
+
+    # --- Warm-up ---
+    def _connect_speech(self, client):
+        channel = client.transport.grpc_channel
+        try:
+            grpc.channel_ready_future(channel).result(timeout=self.connect_timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            logger.warning(f"Speech channel not ready after {self.connect_timeout}s.")
+            return False
+
+    def _touch_tts(self):
+        """Open a TTS connection if the pool has no idle one; the response itself is ignored."""
+        if self.tts_client() is None:
+            return
+        try:
+            self._http.head(self.elevenlabs_api_base + "/")
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not pre-open ElevenLabs connection: {e}")
+
+    def warm_up(self):
+        """Create the shared clients and connect every pooled channel; meant for a background greenlet."""
+        started = time.monotonic()
+        self.speech_client()
+        ready = sum(self._connect_speech(client) for client in self._speech_clients)
+        self._touch_tts()
+        logger.info(
+            f"Warm path ready in {time.monotonic() - started:.2f}s: "
+            f"{ready}/{len(self._speech_clients)} Speech channels connected."
+        )
+
+    # --- Per call ---
+    def _expire(self):
+        cutoff = time.monotonic() - self.prepared_ttl
+        for call_sid in [sid for sid, prepared in self._prepared.items() if prepared.created < cutoff]:
+            del self._prepared[call_sid]
+
+    def prepare(self, call_sid):
+        """Start warming resources for ``call_sid`` in the background."""
+        if not call_sid:
+            return
+        self._expire()
+        client = self.speech_client()
+        if client is None:
+            return
+        prepared = PreparedCall(call_sid, client, self.make_streaming_config())
+        self._prepared[call_sid] = prepared
+        gevent.spawn(self._warm, prepared)
+
+    def _warm(self, prepared):
+        self._connect_speech(prepared.speech_client)
+        self._touch_tts()
+
+    def claim(self, call_sid):
+        """Hand the resources prepared for ``call_sid`` to its session; None if there are none."""
+        prepared = self._prepared.pop(call_sid, None) if call_sid else None
+        if prepared is None:
+            WARM_PATH_MISSES.inc()
+            return None
+        WARM_PATH_HITS.inc()
+        return prepared
+
+    def close(self):
+        for channel in self._channels:
+            channel.close()
+        if self._http is not None:
+            self._http.close()
@@ -1,28 +1,671 @@
+"""Asyncio engine for Twilio's /stream media WebSocket.
+
+An alternative to the gevent handler in app.py with the same behaviour:
+caller audio -> Google streaming STT -> get_bot_response -> ElevenLabs TTS
+-> paced 20 ms mu-law frames back to Twilio. Speech uses the async gRPC
+client and TTS is streamed over a pooled aiohttp session, so a single
+event loop carries many concurrent calls. The launcher forks one worker
+per core; every worker binds the same port with SO_REUSEPORT and the
+kernel spreads incoming connections across them.
+
+The Flask /voice webhook in app.py is unchanged; point its
+WEBSOCKET_STREAM_URL at this server.
+
+Usage:
+    python ws_server.py [--workers N] [--host 0.0.0.0] [--port 8080]
+"""
+import argparse
 import asyncio
-import websockets
+import base64
+import binascii
 import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+import time
+
+import aiohttp
+import grpc
+import websockets
+from google.cloud import speech
+from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport
+from google.oauth2 import service_account
+
+from audio_codec import make_transcoder
+import bot
+from bot import get_bot_response, is_static_response
+from call_session import RecognitionStream, continues_after_handover, needs_new_stream
+from ingest import BYTES_PER_SECOND, AudioRingBuffer, decode_payload, parse_twilio_event
+from media_scheduler import FRAME_SECONDS, take_frames
+from recording import RecordingArchive
+from tts_cache import TTSCache, iter_frames
+from vad import SPEECH_END, SPEECH_START, VADConfig, VoiceActivityDetector
+
+# --- Logging ---
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(levelname)s:%(process)d:%(name)s:%(message)s")
+logger = logging.getLogger("ws_server")
+
+# --- Configuration (same variables as app.py) ---
+GCP_CREDENTIALS_JSON = os.environ.get("GCP_CREDENTIALS_JSON")
+ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
+ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID")
+ELEVENLABS_API_BASE = os.environ.get("ELEVENLABS_API_BASE", "https://api.elevenlabs.io")
+SPEECH_EMULATOR_HOST = os.environ.get("SPEECH_EMULATOR_HOST")
+
+SAMPLE_RATE = 8000
+LANGUAGE_CODE = "he-IL"
+AUDIO_CODEC = os.environ.get("AUDIO_CODEC", "native")
+
+ELEVENLABS_MODEL = "eleven_multilingual_v2"
+ELEVENLABS_OUTPUT_FORMAT = "pcm_16000"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts_cache"))
+TTS_CACHE_MAX_ENTRIES = int(os.environ.get("TTS_CACHE_MAX_ENTRIES", 256))
+
+OUTBOUND_LEAD_MS = int(os.environ.get("OUTBOUND_LEAD_MS", 60))
+OUTBOUND_MAX_QUEUED_FRAMES = int(os.environ.get("OUTBOUND_MAX_QUEUED_FRAMES", 250))
+
+STT_STREAM_LIMIT_SECONDS = int(os.environ.get("STT_STREAM_LIMIT_SECONDS", 290))
+STT_STREAM_OVERLAP_MS = int(os.environ.get("STT_STREAM_OVERLAP_MS", 300))
+STT_STREAM_RETRY_SECONDS = 1.0
+INGEST_COALESCE_MS = int(os.environ.get("INGEST_COALESCE_MS", 100))
+INGEST_BUFFER_SECONDS = int(os.environ.get("INGEST_BUFFER_SECONDS", 10))
+
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "1") == "1"
+VAD_CONFIG = VADConfig.from_env() if VAD_ENABLED else None
+
+RECORDING_DIR = os.environ.get("RECORDING_DIR")
+RECORDING_BUFFER_SECONDS = int(os.environ.get("RECORDING_BUFFER_SECONDS", 30))
+RECORDING_FSYNC_SECONDS = float(os.environ.get("RECORDING_FSYNC_SECONDS", 5))
+
+# --- Clients (created per worker, after fork) ---
+speech_client = None
+http_session = None
+tts_cache = TTSCache(TTS_CACHE_DIR, max_entries=TTS_CACHE_MAX_ENTRIES, codec=AUDIO_CODEC)
+# Its writer thread starts with the first recorded call, i.e. inside each worker
+recording_archive = RecordingArchive(
+    RECORDING_DIR, buffer_seconds=RECORDING_BUFFER_SECONDS, fsync_seconds=RECORDING_FSYNC_SECONDS
+) if RECORDING_DIR else None
+
+
+def make_streaming_config():
+    return speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.MULAW,
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code=LANGUAGE_CODE,
+        ),
+        interim_results=True,
+        single_utterance=True,
+    )
+
+
+async def init_clients():
+    global speech_client, http_session
+    if SPEECH_EMULATOR_HOST:
+        transport = SpeechGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(SPEECH_EMULATOR_HOST))
+        speech_client = speech.SpeechAsyncClient(transport=transport)
+        logger.info(f"Google Cloud Speech async client pointed at emulator {SPEECH_EMULATOR_HOST}.")
+    elif not GCP_CREDENTIALS_JSON:
+        logger.critical("GCP_CREDENTIALS_JSON environment variable is not set. Speech-to-Text will not work.")
+    else:
+        try:
+            credentials = service_account.Credentials.from_service_account_info(json.loads(GCP_CREDENTIALS_JSON))
+            speech_client = speech.SpeechAsyncClient(credentials=credentials)
+            logger.info("Google Cloud Speech async client initialized.")
+        except Exception as e:
+            logger.critical(f"Failed to initialize Google Cloud Speech async client: {e}", exc_info=True)
+
+    if not ELEVENLABS_API_KEY:
+        logger.critical("ELEVENLABS_API_KEY environment variable is not set. Text-to-Speech will not work.")
+    http_session = aiohttp.ClientSession(
+        base_url=ELEVENLABS_API_BASE,
+        headers={"xi-api-key": ELEVENLABS_API_KEY or ""},
+        connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+    )
+
+
+async def close_clients():
+    if http_session is not None:
+        await http_session.close()
+
+
+# --- TTS ---
+def tts_available(text):
+    return bool(ELEVENLABS_API_KEY) or tts_cache.contains(
+        text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT
+    )
+
+
+async def synthesize_mulaw(text):
+    """Async twin of app.synthesize_mulaw(): cache first, else stream from ElevenLabs."""
+    cached = tts_cache.get(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT)
+    if cached is not None:
+        for frame in iter_frames(cached):
+            yield frame
+        return
+
+    logger.debug(f"TTS cache miss, generating TTS for: '{text}'")
+    transcoder = make_transcoder(AUDIO_CODEC)
+    rendered = bytearray()
+    async with http_session.post(
+        f"/v1/text-to-speech/{ELEVENLABS_VOICE_ID}/stream",
+        params={"output_format": ELEVENLABS_OUTPUT_FORMAT},
+        json={"text": text, "model_id": ELEVENLABS_MODEL},
+    ) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_any():
+            mulaw = transcoder.feed(chunk)
+            if mulaw:
+                rendered += mulaw
+                yield mulaw
+    tail = transcoder.flush()
+    if tail:
+        rendered += tail
+        yield tail
+    if is_static_response(text):  # replies with slot values are one-offs; they would only evict the prompts
+        tts_cache.put(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT, rendered)
+
+
+async def prewarm_tts_cache():
+    if not ELEVENLABS_API_KEY:
+        logger.warning("ELEVENLABS_API_KEY is not set. Skipping TTS cache pre-warm.")
+        return
+    if not tts_cache.enabled:
+        logger.info("TTS cache is disabled. Skipping TTS cache pre-warm.")
+        return
+    for text in bot.BOT_RESPONSES:
+        if tts_cache.contains(text, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT):
+            continue
+        try:
+            async for _ in synthesize_mulaw(text):
+                pass
+        except Exception as e:
+            logger.error(f"Failed to pre-render TTS for '{text}': {e}", exc_info=True)
+    logger.info(f"TTS cache pre-warm finished: {tts_cache.stats}")
+
+
+# --- Outbound pacing ---
+class AsyncOutboundScheduler:
+    """asyncio port of media_scheduler.OutboundScheduler; audio is cut into frames by the same take_frames()."""
+
+    def __init__(self, websocket, stream_sid, lead_ms=OUTBOUND_LEAD_MS, max_queued_frames=OUTBOUND_MAX_QUEUED_FRAMES,
+                 tap=None):
+        self.websocket = websocket
+        self.stream_sid = stream_sid
+        self.tap = tap
+        self.lead = lead_ms / 1000.0
+        self._queue = asyncio.Queue(maxsize=max_queued_frames)
+        self._partial = bytearray()
+        self._unfinished = 0
+        self._epoch = 0
+        self._next_due = None
+        self._task = None
+        self.pending_marks = set()
+        self.frames_sent = 0
+        self.clears_sent = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    @property
+    def is_playing(self):
+        return self._unfinished > 0 or bool(self.pending_marks)
+
+    async def send_audio(self, mulaw):
+        self._partial += mulaw
+        await self._queue_frames(take_frames(self._partial))
+
+    async def end_audio(self):
+        await self._queue_frames(take_frames(self._partial, pad=True))
+
+    async def _queue_frames(self, frames):
+        epoch = self._epoch
+        for frame in frames:
+            if epoch != self._epoch:
+                return
+            await self._put((epoch, frame))
+
+    async def mark(self, name):
+        await self._put((self._epoch, name))
+
+    async def _put(self, item):
+        await self._queue.put(item)
+        # Counted only once queued: a put cancelled while waiting for room must not leave is_playing stuck.
+        self._unfinished += 1
+
+    async def barge_in(self):
+        dropped = self._drop_queued()
+        self.pending_marks.clear()
+        await self._send({"event": "clear", "streamSid": self.stream_sid})
+        self.clears_sent += 1
+        logger.debug(f"Barge-in: dropped {dropped} queued items and sent 'clear' to Twilio.")
+
+    def on_mark(self, name):
+        self.pending_marks.discard(name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._drop_queued()
+            self._task.cancel()
+            self._task = None
 
-async def handle_connection(websocket, path):
-    print("🔌 WebSocket connection started.")
+    def _drop_queued(self):
+        self._epoch += 1
+        self._partial.clear()
+        dropped = 0
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._unfinished -= 1
+            dropped += 1
+        self._next_due = None
+        return dropped
+
+    async def _send(self, message):
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _run(self):
+        while True:
+            epoch, payload = await self._queue.get()
+            try:
+                if epoch != self._epoch:
+                    continue
+                if isinstance(payload, str):
+                    await self._send({"event": "mark", "streamSid": self.stream_sid, "mark": {"name": payload}})
+                    self.pending_marks.add(payload)
+                    continue
+                now = time.monotonic()
+                if self._next_due is None or self._next_due < now:
+                    self._next_due = now
+                wait = self._next_due - self.lead - now
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    if epoch != self._epoch:
+                        continue
+                await self._send({
+                    "event": "media",
+                    "streamSid": self.stream_sid,
+                    "media": {"payload": base64.b64encode(payload).decode("utf-8")}
+                })
+                self.frames_sent += 1
+                if self.tap is not None:
+                    self.tap(payload)
+                self._next_due += FRAME_SECONDS
+            finally:
+                self._unfinished -= 1
+
+
+# --- Call session ---
+class AsyncCallSession:
+    """asyncio port of call_session.CallSession: same queues, handover and VAD gating.
+
+    The per-stream rules (RecognitionStream, needs_new_stream,
+    continues_after_handover) are imported from call_session, so only the
+    waiting and sending differ between the engines.
+    """
+
+    def __init__(self, websocket, scheduler, vad_config=VAD_CONFIG, queue_size=8, recorder=None):
+        self.websocket = websocket
+        self.scheduler = scheduler
+        self.recorder = recorder
+        self.streaming_config = make_streaming_config()
+        self.overlap_bytes = STT_STREAM_OVERLAP_MS * BYTES_PER_SECOND // 1000
+        self.coalesce_bytes = max(1, INGEST_COALESCE_MS * BYTES_PER_SECOND // 1000)
+        self.coalesce_timeout = max(INGEST_COALESCE_MS, 20) / 1000.0 * 2
+
+        self.audio = AudioRingBuffer(INGEST_BUFFER_SECONDS * BYTES_PER_SECOND)
+        self._audio_ready = asyncio.Event()
+        self.vad = VoiceActivityDetector(vad_config) if vad_config is not None else None
+        self.transcripts = asyncio.Queue(maxsize=queue_size)
+        self.replies = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self._tasks = set()
+        self._active_stream = None
+        self._stream_count = 0
+        self.turns = 0
+        self.frames_in = 0
+        self.decode_errors = 0
+        self.requests_sent = 0
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self):
+        self._spawn(self._bot_loop())
+        self._spawn(self._playback_loop())
+        if self.vad is None:
+            self._start_stream(self.audio.end)
+        try:
+            await self._inbound_loop()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.audio.close()
+        self._audio_ready.set()
+        for task in list(self._tasks):
+            task.cancel()
+        if self.recorder is not None:
+            self.recorder.close()
+        logger.info(
+            f"Call session closed after {self.turns} turns and {self._stream_count} recognition streams: "
+            f"{self.frames_in} frames in, {self.requests_sent} recognition requests, "
+            f"{self.decode_errors} decode errors, {self.audio.dropped_bytes} bytes dropped."
+        )
+
+    # --- Inbound ---
+    async def _inbound_loop(self):
+        try:
+            async for message in self.websocket:
+                event, payload = parse_twilio_event(message)
+                if event == "media":
+                    self.frames_in += 1
+                    try:
+                        audio = decode_payload(payload)
+                    except (binascii.Error, TypeError):
+                        self.decode_errors += 1
+                        continue
+                    self.audio.write(audio)
+                    self._audio_ready.set()
+                    if self.recorder is not None:
+                        self.recorder.inbound(audio)
+                    if self.vad is not None:
+                        for vad_event, pos in self.vad.process(audio):
+                            await self._on_vad_event(vad_event, pos)
+                    continue
+
+                data = json.loads(message)
+                if event == "mark":
+                    self.scheduler.on_mark(data.get("mark", {}).get("name"))
+                elif event == "start":
+                    start = data.get("start", {})
+                    self.scheduler.stream_sid = data.get("streamSid") or start.get("streamSid", self.scheduler.stream_sid)
+                    if self.recorder is not None:
+                        self.recorder.start(start.get("callSid"), self.scheduler.stream_sid)
+                    logger.info(f"Twilio 'start' event received: streamSid={self.scheduler.stream_sid} callSid={start.get('callSid')}")
+                elif event == "stop":
+                    logger.info(f"Twilio 'stop' event received: streamSid={data.get('streamSid')}")
+                    break
+        except websockets.exceptions.ConnectionClosed as e:
+            logger.info(f"WebSocket closed by peer: {e}")
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON Decode Error in WebSocket message: {e}", exc_info=True)
+
+    async def _on_vad_event(self, vad_event, pos):
+        if vad_event == SPEECH_START:
+            if self.scheduler.is_playing:
+                await self.scheduler.barge_in()
+                if self.recorder is not None:
+                    self.recorder.event("barge_in")
+            if needs_new_stream(self._active_stream):
+                self._start_stream(pos)
+        elif vad_event == SPEECH_END:
+            stream = self._active_stream
+            if stream is not None and not stream.half_closed:
+                stream.stop_pos = pos
+
+    # --- Recognition ---
+    def _start_stream(self, start_pos):
+        if self.closed:
+            return
+        self._stream_count += 1
+        stream = RecognitionStream(self._stream_count, max(start_pos, self.audio.start))
+        self._active_stream = stream
+        self._spawn(self._recognize(stream))
+
+    def _handover(self, stream, reason):
+        if stream.half_closed:
+            return
+        stream.half_closed = True
+        logger.debug(f"Recognition stream #{stream.number} handing over ({reason}).")
+        if continues_after_handover(stream, self._active_stream, self.vad):
+            self._start_stream(stream.pos - self.overlap_bytes)
+
+    async def _wait_for_audio(self, stream):
+        deadline = time.monotonic() + self.coalesce_timeout
+        while self.audio.end - stream.pos < self.coalesce_bytes and not self.audio.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._audio_ready.clear()
+            try:
+                await asyncio.wait_for(self._audio_ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _requests(self, stream):
+        yield speech.StreamingRecognizeRequest(streaming_config=self.streaming_config)
+        while not stream.half_closed and not self.closed:
+            await self._wait_for_audio(stream)
+            audio, pos = self.audio.read(stream.pos, timeout=0)
+            audio, held = stream.advance(audio, pos, self.vad)
+            if audio:
+                self.requests_sent += 1
+                yield speech.StreamingRecognizeRequest(audio_content=audio)
+            elif self.audio.closed:
+                break
+            elif held:
+                await asyncio.sleep(self.coalesce_timeout / 2)
+            if stream.utterance_sent:
+                break
+            if time.monotonic() - stream.started > STT_STREAM_LIMIT_SECONDS:
+                self._handover(stream, "duration limit")
+
+    async def _recognize(self, stream):
+        logger.debug(f"Opening recognition stream #{stream.number}...")
+        try:
+            responses = await speech_client.streaming_recognize(requests=self._requests(stream))
+            async for response in responses:
+                if response.speech_event_type == speech.StreamingRecognizeResponse.SpeechEventType.END_OF_SINGLE_UTTERANCE:
+                    self._handover(stream, "end of utterance")
+                if not response.results or not response.results[0].alternatives:
+                    continue
+
+                result = response.results[0]
+                transcript = result.alternatives[0].transcript
+                if not result.is_final:
+                    if self.vad is None and self.scheduler.is_playing and transcript.strip():
+                        await self.scheduler.barge_in()
+                        if self.recorder is not None:
+                            self.recorder.event("barge_in")
+                    continue
+
+                logger.debug(f"Final transcript received: '{transcript}'")
+                self._handover(stream, "final result")
+                if transcript.strip():
+                    await self.transcripts.put(transcript)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self.closed:
+                logger.error(f"Recognition stream #{stream.number} failed: {e}", exc_info=True)
+                if not stream.half_closed:
+                    await asyncio.sleep(STT_STREAM_RETRY_SECONDS)
+        finally:
+            if not self.closed:
+                self._handover(stream, "stream ended")
+
+    # --- Bot logic and playback ---
+    async def _bot_loop(self):
+        while True:
+            transcript = await self.transcripts.get()
+            try:
+                reply = get_bot_response(transcript)
+            except Exception as e:
+                logger.error(f"Bot failed to answer '{transcript}': {e}", exc_info=True)
+                continue
+            if self.recorder is not None:
+                self.recorder.event("transcript", text=transcript)
+                self.recorder.event("response", text=reply)
+            await self.replies.put(reply)
+
+    async def _playback_loop(self):
+        while True:
+            reply = await self.replies.get()
+            if not tts_available(reply):
+                logger.error("ElevenLabs API key is not set. Cannot perform Text-to-Speech.")
+                continue
+            self.turns += 1
+            epoch = self.scheduler.epoch
+            # Notify Twilio that bot response is starting
+            await self.scheduler.mark("bot_response_start")
+            try:
+                async for mulaw in synthesize_mulaw(reply):
+                    if self.scheduler.epoch != epoch:
+                        logger.debug("Bot response interrupted by caller.")
+                        break
+                    await self.scheduler.send_audio(mulaw)
+                else:
+                    await self.scheduler.end_audio()
+                    await self.scheduler.mark("bot_response_end")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error processing or sending audio chunk: {e}", exc_info=True)
+
+
+# --- WebSocket handler ---
+async def handle_connection(websocket):
+    path = websocket.request.path.split("?", 1)[0]
+    if path != "/stream":
+        logger.warning(f"❌ WebSocket connection to unexpected path '{path}'.")
+        await websocket.close(code=1008, reason="This server only serves /stream")
+        return
+    if speech_client is None:
+        logger.error("Speech client is not initialized. Cannot perform speech recognition.")
+        await websocket.close(code=1011, reason="Speech client not ready")
+        return
+
+    logger.info("🔌 WebSocket connection started.")
+    recorder = recording_archive.open_call() if recording_archive is not None else None
+    scheduler = AsyncOutboundScheduler(websocket, "unknown_sid", tap=recorder.outbound if recorder is not None else None).start()
+    session = AsyncCallSession(websocket, scheduler, recorder=recorder)
+    try:
+        await session.run()
+    except Exception as e:
+        logger.error(f"Critical WebSocket handler error: {e}", exc_info=True)
+    finally:
+        await scheduler.stop()
+        logger.info("WebSocket closed.")
+
+
+# --- Workers ---
+def make_listen_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+async def serve(host, port, worker):
+    await init_clients()
+    if worker == 0:
+        asyncio.create_task(prewarm_tts_cache())
+        # Reloads happen inside get_bot_response(), i.e. on this event loop
+        bot.on_responses_changed(lambda: asyncio.get_running_loop().create_task(prewarm_tts_cache()))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    sock = make_listen_socket(host, port)
+    async with websockets.serve(handle_connection, sock=sock, compression=None):
+        logger.info(f"🔊 Worker {worker} serving ws://{host}:{port}/stream")
+        await stop.wait()
+    await close_clients()
+    if recording_archive is not None:
+        recording_archive.close()
+
+
+def run_worker(host, port, worker):
     try:
-        async for message in websocket:
-            data = json.loads(message)
-            event = data.get("event")
-
-            if event == "start":
-                print("📞 Call started")
-            elif event == "media":
-                payload = data.get("media", {}).get("payload")
-                print(f"🎤 Received audio payload (len={len(payload)})")
-            elif event == "stop":
-                print("🛑 Call ended")
-    except websockets.exceptions.ConnectionClosed as e:
-        print(f"❌ Connection closed: {e}")
-
-async def main():
-    async with websockets.serve(handle_connection, "0.0.0.0", 8080):
-        print("🔊 WebSocket server is running on ws://0.0.0.0:8080")
-        await asyncio.Future()  # keep alive
+        asyncio.run(serve(host, port, worker))
+    except Exception as e:
+        logger.critical(f"Worker {worker} crashed: {e}", exc_info=True)
+        raise
+
+
+def run_workers(host, port, workers):
+    """Fork ``workers`` processes sharing the port and restart any that die."""
+    if workers <= 1:
+        run_worker(host, port, 0)
+        return
+
+    children = {}
+    stopping = False
+
+    def spawn(worker):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(host, port, worker)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = worker
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for worker in range(workers):
+        spawn(worker)
+    logger.info(f"Started {workers} workers on {host}:{port} (SO_REUSEPORT).")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker = children.pop(pid, None)
+        if worker is not None and not stopping:
+            logger.warning(f"Worker {worker} (pid {pid}) exited with status {status}, restarting.")
+            time.sleep(1)
+            spawn(worker)
+    logger.info("All workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio Twilio media-stream server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WS_WORKERS", os.cpu_count() or 1)))
+    args = parser.parse_args()
+    run_workers(args.host, args.port, args.workers)
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()